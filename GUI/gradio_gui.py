@@ -1,10 +1,17 @@
 import gradio as gr
-import requests
+import httpx
+import codecs
+import orjson
+import pandas as pd
 import time
 import sys
 import os
 import logging
-import json
+import functools
+import inspect
+import io
+import threading
+from collections import OrderedDict
 from pathlib import Path
 
 # 设置项目根目录路径
@@ -12,9 +19,39 @@ root_dir = Path(__file__).parent
 sys.path.insert(0, str(root_dir))
 
 # 配置API端点
-API_URL = "http://localhost:8000/generate"
-COMPARE_URL = "http://localhost:8000/compare"
-HEALTH_URL = "http://localhost:8000/health"
+BASE_URL = "http://localhost:8000"
+API_URL = f"{BASE_URL}/generate"
+HEALTH_URL = f"{BASE_URL}/health"
+
+# 各模型在提示前添加的前缀，后端据此选择模型
+PROVIDER_PREFIX = {"qwen": "qwen "}
+
+# 知识库结果字段与表头的对应关系
+KB_COLUMNS = {"content": "内容", "source": "来源", "score": "相关性"}
+
+# 地图结果输出模板（每行以换行结尾）
+MAP_HELP_HEADER = "🗺️ 地图服务使用说明\n" + "=" * 30 + "\n"
+MAP_TYPE_TMPL = "🔍 {type}\n" + "=" * 30 + "\n"
+MAP_QUERY_TMPL = "🔎 查询内容: {query}\n"
+MAP_ADDR_TMPL = "🏠 详细地址: {addr}\n📍 坐标位置: {coord}\n🗺️ 行政区划: {prov}{city}{reg}\n\n"
+MAP_REVERSE_TMPL = (
+    "🏠 详细地址: {addr}\n📍 坐标位置: {coord}\n"
+    "🗺️ 行政区划: {prov} → {city} → {reg}\n🏘️ 街道信息: {street}\n\n"
+)
+MAP_SEARCH_TMPL = "🔍 搜索关键词: {keyword}\n🌆 搜索范围: {scope}\n📊 找到 {count} 个结果:\n\n"
+
+# 界面样式表：启动时读取一次
+STATIC_DIR = root_dir / "static"
+CSS = (STATIC_DIR / "app.css").read_text(encoding="utf-8")
+
+# 请求超时：连接阶段2秒即失败（后端不可达时快速返回），读取阶段按接口类型区分
+FAST_TIMEOUT = httpx.Timeout(10, connect=2)      # 健康检查、计算器
+LOOKUP_TIMEOUT = httpx.Timeout(15, connect=2)    # 地图、知识库
+STREAM_TIMEOUT = httpx.Timeout(60, connect=2)    # 流式生成
+LONG_TIMEOUT = httpx.Timeout(120, connect=2)     # 参数对比
+
+# 流式输出时界面刷新的最小间隔（秒）
+STREAM_EMIT_INTERVAL = 0.04
 
 # 设置日志
 logging.basicConfig(
@@ -25,231 +62,369 @@ logging.basicConfig(
 )
 logger = logging.getLogger("gradio_gui")
 
-def generate_response(prompt, temperature, max_tokens, provider):
+# 复用连接池的全局异步客户端（后端地址固定，保持长连接）
+# 处理函数均为async，Gradio直接在事件循环中调度，不再占用线程池
+ASYNC_CLIENT = httpx.AsyncClient(
+    base_url=BASE_URL,
+    timeout=STREAM_TIMEOUT,
+    limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+    transport=httpx.AsyncHTTPTransport(retries=2)
+)
+
+
+def ttl_cache(maxsize=256, ttl=600, cache_if=None):
+    """带过期时间的LRU缓存装饰器（线程安全）
+
+    只缓存正常返回的结果，抛出的异常不会被缓存；
+    cache_if 可进一步过滤不应缓存的返回值。
+    """
+    def decorator(func):
+        cache = OrderedDict()
+        lock = threading.Lock()
+        missing = object()
+
+        def lookup(args):
+            with lock:
+                entry = cache.get(args)
+                if entry is not None and time.monotonic() - entry[0] < ttl:
+                    cache.move_to_end(args)
+                    return entry[1]
+            return missing
+
+        def store(args, value):
+            if cache_if is None or cache_if(value):
+                with lock:
+                    cache[args] = (time.monotonic(), value)
+                    cache.move_to_end(args)
+                    while len(cache) > maxsize:
+                        cache.popitem(last=False)
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args):
+                value = lookup(args)
+                if value is missing:
+                    value = await func(*args)
+                    store(args, value)
+                return value
+        else:
+            @functools.wraps(func)
+            def wrapper(*args):
+                value = lookup(args)
+                if value is missing:
+                    value = func(*args)
+                    store(args, value)
+                return value
+
+        wrapper.cache_clear = cache.clear
+        return wrapper
+    return decorator
+
+
+JSON_HEADERS = {"Content-Type": "application/json"}
+# 流式接口不压缩，避免分块被重新缓冲
+STREAM_HEADERS = {**JSON_HEADERS, "Accept-Encoding": "identity"}
+
+
+async def _post(path, payload, timeout, headers=JSON_HEADERS):
+    """使用orjson序列化请求体并POST到后端"""
+    return await ASYNC_CLIENT.post(
+        path,
+        content=orjson.dumps(payload),
+        headers=headers,
+        timeout=timeout
+    )
+
+async def generate_response(prompt, temperature, max_tokens, provider):
     """处理流式响应生成"""
-      # 根据选择的provider添加前缀
-    if provider == "qwen":
-        formatted_prompt = f"qwen {prompt}"  # 添加qwen前缀
-    else:
-        formatted_prompt = prompt  # DeepSeek不需要前缀
+    # 根据选择的provider添加前缀（DeepSeek不需要前缀）
+    formatted_prompt = PROVIDER_PREFIX.get(provider, "") + prompt
 
-    logger.info(f"开始请求: prompt='{formatted_prompt[:50]}...', temp={temperature}, tokens={max_tokens}, provider={provider}")
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("开始请求: prompt=%r, temp=%s, tokens=%s, provider=%s",
+                    formatted_prompt[:50], temperature, max_tokens, provider)
     
     try:
         # 构建请求
-        response = requests.post(
-            API_URL,
-            json={
+        async with ASYNC_CLIENT.stream(
+            "POST",
+            "/generate",
+            content=orjson.dumps({
                 "prompt": formatted_prompt,
                 "temperature": temperature,
                 "max_tokens": max_tokens,
                 "provider": provider
-            },
-            stream=True,
-            timeout=60
-        )
-        
-        # 检查响应状态
-        if response.status_code != 200:
-            error_msg = f"API错误: {response.status_code} - {response.text[:200]}"
-            logger.error(error_msg)
-            yield error_msg
-            return
-        
-        logger.info(f"收到响应: 状态码={response.status_code}")
-        
-        # 处理流式响应
-        full_response = ""
-        for chunk in response.iter_content(chunk_size=None):
-            if chunk:
-                try:
-                    # 直接解码为UTF-8
-                    text = chunk.decode('utf-8', errors='replace')
-                    full_response += text
-                    yield full_response
-                except Exception as e:
-                    error = f"\n解码错误: {str(e)}"
-                    logger.error(error)
-                    yield error
-        
-        logger.info(f"请求完成, 总长度={len(full_response)}字符")
+            }),
+            headers=STREAM_HEADERS,
+            timeout=STREAM_TIMEOUT
+        ) as response:
+            
+            # 检查响应状态
+            if response.status_code != 200:
+                body = (await response.aread()).decode('utf-8', 'replace')
+                error_msg = f"API错误: {response.status_code} - {body[:200]}"
+                logger.error(error_msg)
+                yield error_msg
+                return
+            
+            logger.info("收到响应: 状态码=%s", response.status_code)
+            
+            # 处理流式响应：限制向界面推送的频率
+            # 增量解码器会保留跨块截断的多字节字符，避免中途出现替换字符
+            # 注意：httpx的aiter_bytes(chunk_size)会攒满整块才返回，这里按到达的数据读取
+            decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+            pending = []
+            text_out = ""
+            last_emit = time.monotonic()
+            async for chunk in response.aiter_bytes():
+                if chunk:
+                    pending.append(decoder.decode(chunk, final=False))
+
+                    now = time.monotonic()
+                    if now - last_emit >= STREAM_EMIT_INTERVAL:
+                        last_emit = now
+                        text_out += "".join(pending)
+                        pending.clear()
+                        yield text_out
+
+            # 推送最后一段尚未输出的内容
+            pending.append(decoder.decode(b'', final=True))
+            if any(pending):
+                text_out += "".join(pending)
+                yield text_out
+            
+            logger.info("请求完成, 总长度=%d字符", len(text_out))
             
     except Exception as e:
-        error = f"请求失败: {str(e)}"
-        logger.exception(error)
-        yield error
+        # 客户端断开等异常较常见，堆栈只在DEBUG级别下才格式化
+        logger.error("请求失败: %s", e)
+        logger.debug("traceback", exc_info=True)
+        yield f"请求失败: {str(e)}"
 
-def compare_responses(prompt, max_tokens, provider):
-    """处理参数对比 - 修复模型切换问题"""
-    logger.info(f"开始对比请求: prompt='{prompt[:50]}...', tokens={max_tokens}, provider={provider}")
+async def compare_responses(prompt, max_tokens, provider):
+    """处理参数对比 - 后端/compare并发执行两个温度的生成并校验输出"""
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("开始对比请求: prompt=%r, tokens=%s, provider=%s",
+                    prompt[:50], max_tokens, provider)
     
     try:
-        response = requests.post(
-            COMPARE_URL,
-            json={
+        response = await _post(
+            "/compare",
+            {
                 "prompt": prompt,
                 "max_tokens": max_tokens,
                 "provider": provider  # 确保传递provider参数
             },
-            timeout=60
+            timeout=LONG_TIMEOUT
         )
+        response.raise_for_status()
+        data = orjson.loads(response.content)
         
-        if response.status_code == 200:
-            data = response.json()
-            logger.info("对比请求成功完成")
-            return [
-                data.get("low_temp", "无结果"),
-                data.get("high_temp", "无结果"),
-                data.get("analysis", "无分析结果")
-            ]
-        else:
-            error_msg = f"API错误: {response.status_code} - {response.text[:200]}"
-            logger.error(error_msg)
-            return ["错误", "错误", error_msg]
+        logger.info("对比请求成功完成")
+        return [
+            data.get("low_temp", "无结果"),
+            data.get("high_temp", "无结果"),
+            data.get("analysis", "无分析结果")
+        ]
     
+    except httpx.HTTPStatusError as e:
+        error_msg = f"API错误: {e.response.status_code} - {e.response.text[:200]}"
+        logger.error(error_msg)
+        return ["错误", "错误", error_msg]
     except Exception as e:
-        error = f"请求失败: {str(e)}"
-        logger.exception(error)
-        return ["错误", "错误", error]
+        logger.error("请求失败: %s", e)
+        logger.debug("traceback", exc_info=True)
+        return ["错误", "错误", f"请求失败: {str(e)}"]
     
-def calculate_expression(expression):
+@ttl_cache(maxsize=256, ttl=600)
+async def _calculate(expression):
+    """请求后端计算表达式（结果按表达式缓存）"""
+    response = await _post(
+        "/calculate",
+        {"prompt": f"calc:{expression}"},
+        timeout=FAST_TIMEOUT
+    )
+
+    # 增强错误处理
+    if response.status_code == 403:
+        return "安全验证失败"
+    response.raise_for_status()
+    return orjson.loads(response.content).get("result", "无结果")
+
+async def calculate_expression(expression):
     """处理计算器请求"""
     try:
         # 添加超时和空表达式处理
-        if not expression.strip():
+        expression = expression.strip()
+        if not expression:
             return "请输入表达式"
         
-        response = requests.post(
-            "http://localhost:8000/calculate",
-            json={"prompt": f"calc:{expression}"},
-            timeout=10
-        )
-        
-        # 增强错误处理
-        if response.status_code == 200:
-            return response.json().get("result", "无结果")
-        elif response.status_code == 403:
-            return "安全验证失败"
-        else:
-            return f"API错误: {response.status_code}"
+        return await _calculate(expression)
             
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
         return "请求超时"
+    except httpx.HTTPStatusError as e:
+        return f"API错误: {e.response.status_code}"
     except Exception as e:
         return f"请求失败: {str(e)}"
 
-def map_service(command):
+@ttl_cache(maxsize=256, ttl=600, cache_if=lambda data: "error" not in data)
+async def _fetch_map(command):
+    """请求后端地图服务（错误结果不缓存）"""
+    response = await _post(
+        "/map",
+        {"prompt": command},
+        timeout=LOOKUP_TIMEOUT
+    )
+    response.raise_for_status()
+    return orjson.loads(response.content)
+
+def _map_header(data):
+    """结果标题与查询内容"""
+    out = ""
+    if "type" in data:
+        out += MAP_TYPE_TMPL.format(type=data["type"])
+    if "查询" in data:
+        out += MAP_QUERY_TMPL.format(query=data["查询"])
+    return out
+
+def _map_address(data):
+    """地址信息段落"""
+    return MAP_ADDR_TMPL.format(
+        addr=data["地址"],
+        coord=data.get("坐标", "未知"),
+        prov=data.get("省份", ""),
+        city=data.get("城市", ""),
+        reg=data.get("区域", "")
+    )
+
+def _map_street(data):
+    """坐标解析的行政区划与街道段落"""
+    return MAP_REVERSE_TMPL.format(
+        addr=data["地址"],
+        coord=data["查询"],
+        prov=data["省份"],
+        city=data["城市"],
+        reg=data["区域"],
+        street=data["街道"]
+    )
+
+def _map_search(data):
+    """地点搜索结果段落"""
+    return MAP_SEARCH_TMPL.format(
+        keyword=data["关键词"],
+        scope=data["范围"],
+        count=data["结果数量"]
+    ) + "".join(
+        f"⭐ 结果 {i}:\n" + "".join(f"   - {k}: {v}\n" for k, v in poi.items()) + "\n"
+        for i, poi in enumerate(data["结果"], 1)
+    )
+
+def _format_map_help(data):
+    return MAP_HELP_HEADER + "\n".join(data["commands"])
+
+def _format_map_geocode(data):
+    return (_map_header(data) + _map_address(data))[:-1]
+
+def _format_map_reverse(data):
+    return (_map_header(data) + _map_address(data) + _map_street(data))[:-1]
+
+def _format_map_search(data):
+    return (_map_header(data) + _map_search(data))[:-1]
+
+def _format_map_default(data):
+    """未知类型：按字段逐段拼接"""
+    # 格式化输出：每段以换行结尾写入缓冲区，最后去掉末尾换行
+    out = io.StringIO()
+    out.write(_map_header(data))
+    if "地址" in data:
+        out.write(_map_address(data))
+    if "街道" in data:
+        out.write(_map_street(data))
+    if "结果" in data:
+        out.write(_map_search(data))
+    
+    formatted = out.getvalue()
+    return formatted[:-1] if formatted else "无结果"
+
+# 按后端返回的结果类型分派格式化函数
+MAP_FORMATTERS = {
+    "help": _format_map_help,
+    "地址解析结果": _format_map_geocode,
+    "坐标解析结果": _format_map_reverse,
+    "地点搜索结果": _format_map_search
+}
+
+async def map_service(command):
     """处理地图服务请求 - 改进版"""
     try:
         # 确保命令有map:前缀
+        command = command.strip()
         if not command.startswith("map:"):
             command = "map:" + command
 
-        response = requests.post(
-            "http://localhost:8000/map",
-            json={"prompt": command},
-            timeout=15
-        )
+        data = await _fetch_map(command)
         
-        if response.status_code == 200:
-            data = response.json()
-            
-            # 格式化输出
-            formatted = []
-            
-            if "help" in data:
-                formatted.append("🗺️ 地图服务使用说明")
-                formatted.append("="*30)
-                formatted.extend(data["commands"])
-                return "\n".join(formatted)
-            
-            if "error" in data:
-                return f"❌ 错误: {data['error']}"
-            
-            # 根据不同类型格式化输出
-            if "type" in data:
-                formatted.append(f"🔍 {data['type']}")
-                formatted.append("="*30)
-            
-            if "查询" in data:
-                formatted.append(f"🔎 查询内容: {data['查询']}")
-            
-            # 处理地址解析结果
-            if "地址" in data:
-                formatted.extend([
-                    f"🏠 详细地址: {data['地址']}",
-                    f"📍 坐标位置: {data.get('坐标', '未知')}",
-                    f"🗺️ 行政区划: {data.get('省份', '')}{data.get('城市', '')}{data.get('区域', '')}",
-                    ""
-                ])
-            
-            # 处理坐标解析结果
-            if "街道" in data:
-                formatted.extend([
-                    f"🏠 详细地址: {data['地址']}",
-                    f"📍 坐标位置: {data['查询']}",
-                    f"🗺️ 行政区划: {data['省份']} → {data['城市']} → {data['区域']}",
-                    f"🏘️ 街道信息: {data['街道']}",
-                    ""
-                ])
-            
-            # 处理地点搜索结果
-            if "结果" in data:
-                formatted.append(f"🔍 搜索关键词: {data['关键词']}")
-                formatted.append(f"🌆 搜索范围: {data['范围']}")
-                formatted.append(f"📊 找到 {data['结果数量']} 个结果:")
-                formatted.append("")
-                
-                for i, result in enumerate(data["结果"], 1):
-                    for key, value in result.items():
-                        formatted.append(f"⭐ {key}:")
-                        for k, v in value.items():
-                            formatted.append(f"   - {k}: {v}")
-                        formatted.append("")
-            
-            return "\n".join(formatted) if formatted else "无结果"
+        if "error" in data:
+            return f"❌ 错误: {data['error']}"
         
-        return f"API错误: {response.status_code}"
+        # 根据不同类型格式化输出（帮助信息没有type字段）
+        result_type = "help" if "help" in data else data.get("type")
+        return MAP_FORMATTERS.get(result_type, _format_map_default)(data)
     
+    except httpx.HTTPStatusError as e:
+        return f"API错误: {e.response.status_code}"
     except Exception as e:
         return f"请求失败: {str(e)}"
 
-def knowledge_base_search(query):
+@ttl_cache(maxsize=256, ttl=600)
+async def _search_knowledge_base(query):
+    """请求后端知识库检索（结果按查询缓存）"""
+    response = await _post(
+        "/knowledge_base",
+        {"prompt": query},
+        timeout=LOOKUP_TIMEOUT
+    )
+    response.raise_for_status()
+    return orjson.loads(response.content).get("results", [])
+
+async def knowledge_base_search(query):
     """处理知识库查询"""
     try:
         # 确保查询有kb:前缀
+        query = query.strip()
         if not query.startswith("kb:"):
             query = "kb:" + query
             
-        response = requests.post(
-            "http://localhost:8000/knowledge_base",
-            json={"prompt": query},
-            timeout=15
-        )
-        if response.status_code == 200:
-            data = response.json().get("results", [])
-            # 转换为Dataframe格式
-            return [[
-                item["content"],
-                item["source"],
-                item["score"]
-            ] for item in data]
-        return []
+        data = await _search_knowledge_base(query)
+        # 转换为Dataframe格式（按列构建，直接交给gr.Dataframe）
+        return pd.DataFrame.from_records(data, columns=list(KB_COLUMNS)).rename(columns=KB_COLUMNS)
     except Exception as e:
-        return []
+        return pd.DataFrame(columns=list(KB_COLUMNS.values()))
 
-def check_health():
+@ttl_cache(maxsize=1, ttl=10, cache_if=lambda r: r[1] is not None)
+async def _fetch_health():
+    """请求后端健康检查，返回(状态码, 响应数据)
+
+    check_health与update_model_status共用该缓存，10秒内的重复点击不再请求后端；
+    只缓存正常结果，服务恢复后能立即反映出来。
+    """
+    response = await ASYNC_CLIENT.get("/health", timeout=FAST_TIMEOUT)
+    if response.status_code == 200:
+        return response.status_code, orjson.loads(response.content)
+    return response.status_code, None
+
+async def check_health():
     """检查后端服务状态"""
     try:
-        response = requests.get(HEALTH_URL, timeout=5)
-        if response.status_code == 200:
-            data = response.json()
+        status_code, data = await _fetch_health()
+        if data is not None:
             # 更新为新的响应格式
             status = "✅ 服务运行正常\n"
             status += f"模型: {data.get('model', '未知')}\n"
             status += f"状态: {data.get('status', '未知')}"
             return status
-        return f"⚠️ 服务异常: {response.status_code}"
+        return f"⚠️ 服务异常: {status_code}"
     except Exception as e:
         return f"❌ 服务不可达: {str(e)}"
 
@@ -257,31 +432,7 @@ def check_health():
 with gr.Blocks(
     title="LLM对话系统",
     theme=gr.themes.Soft(),
-    css="""
-    .output-box {
-        font-family: 'Microsoft YaHei', 'PingFang SC', 'SimHei', sans-serif;
-        font-size: 16px;
-        line-height: 1.6;
-        white-space: pre-wrap;
-        overflow-y: auto;
-        background-color: #f9f9f9;
-        border-radius: 8px;
-        padding: 15px;
-        min-height: 300px;
-    }
-    .input-box {
-        font-size: 16px;
-        padding: 12px;
-        font-family: 'Microsoft YaHei', 'PingFang SC', 'SimHei', sans-serif;
-    }
-    .model-status {
-        background-color: #e6f7ff;
-        border: 1px solid #91d5ff;
-        border-radius: 6px;
-        padding: 10px;
-        margin-bottom: 15px;
-    }
-    """
+    css=CSS
 ) as demo:
     gr.Markdown("# 🧠 LLM智能对话系统")
     gr.Markdown("基于DeepSeek和通义千问大模型的对话应用")
@@ -377,7 +528,8 @@ with gr.Blocks(
         calc_btn.click(
             fn=calculate_expression,
             inputs=calc_input,
-            outputs=calc_output
+            outputs=calc_output,
+            queue=False  # 短请求不进入LLM队列
         )
 
     with gr.Tab("🗺️ 地图服务"):
@@ -401,7 +553,8 @@ with gr.Blocks(
         map_btn.click(
             fn=map_service,
             inputs=map_input,
-            outputs=map_output
+            outputs=map_output,
+            queue=False  # 短请求不进入LLM队列
         )
 
     with gr.Tab("📚 知识库"):
@@ -495,7 +648,8 @@ with gr.Blocks(
                     check_btn = gr.Button("🔄 检查服务状态")
                     check_btn.click(
                         fn=check_health,
-                        outputs=status
+                        outputs=status,
+                        queue=False  # 短请求不进入LLM队列
                     )
         
             with gr.Column(scale=2):
@@ -507,12 +661,11 @@ with gr.Blocks(
                     qwen_status = gr.Markdown("**Qwen模型**:\n- 状态: 正常")
                     
                     # 定义更新模型状态的函数
-                    def update_model_status():
+                    async def update_model_status():
                         """更新模型状态显示"""
                         try:
-                            response = requests.get(HEALTH_URL, timeout=5)
-                            if response.status_code == 200:
-                                data = response.json()
+                            _, data = await _fetch_health()
+                            if data is not None:
                                 # 简化显示，因为后端只返回基本状态
                                 return f"**服务状态**: ✅ 正常\n**当前模型**: {data.get('model', '未知')}"
                             return "**服务状态**: ⚠️ 异常"
@@ -530,20 +683,24 @@ with gr.Blocks(
 
 # 启动界面
 if __name__ == "__main__":
-    # 打印配置信息
-    print("=" * 50)
-    print("LLM对话系统GUI")
-    print("=" * 50)
-    print(f"后端API地址: {API_URL}")
-    print(f"对比API地址: {COMPARE_URL}")
-    print(f"健康检查地址: {HEALTH_URL}")
-    print("\n请确保后端服务正在运行 (python main.py)")
-    print("=" * 50)
+    # 打印配置信息（拼接后一次性输出，同时写入日志）
+    banner = "\n".join([
+        "=" * 50,
+        "LLM对话系统GUI",
+        "=" * 50,
+        f"后端API地址: {API_URL}",
+        f"健康检查地址: {HEALTH_URL}",
+        "\n请确保后端服务正在运行 (python main.py)",
+        "=" * 50,
+        "启动Gradio界面...",
+        "请访问: http://localhost:7860",
+        "=" * 50
+    ])
+    print(banner, flush=True)
+    logger.info(banner)
     
-    # 启动GUI
-    print("启动Gradio界面...")
-    print(f"请访问: http://localhost:7860")
-    print("=" * 50)
+    # 启用队列：流式生成长期占用worker，并发数与后端并行能力匹配
+    demo.queue(default_concurrency_limit=4, max_size=32, status_update_rate="auto")
     
     demo.launch(
         server_name="0.0.0.0",
@@ -1,8 +1,11 @@
 # main.py - 主应用入口
 import os
+import re
+import asyncio
+import inspect
 import logging
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.responses import StreamingResponse, JSONResponse, ORJSONResponse
 from dotenv import load_dotenv
 from pydantic import BaseModel
 import httpx
@@ -24,20 +27,51 @@ logger = logging.getLogger("main")
 
 # 加载环境变量
 load_dotenv()
-API_KEY = os.getenv("DEEPSEEK_API_KEY")
-QWEN_API_KEY = os.getenv("QWEN_API_KEY")
-if not API_KEY:
+if not os.getenv("DEEPSEEK_API_KEY"):
     logger.error("API密钥未配置！请在.env文件中设置DEEPSEEK_API_KEY")
     raise RuntimeError("API密钥未配置")
 
 # 获取项目根目录
 BASE_DIR = Path(__file__).parent
 
+# 知识库检索结果中每条内容的最大预览长度（超出部分以...结尾）
+KB_PREVIEW_LENGTH = 500
+
+# 流式响应头：禁用缓存及反向代理缓冲，保证逐块推送
+STREAM_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+# 安全中间件放行的功能命令前缀（直接在原始字节上比较），仅对功能命令端点生效
+_ALLOWED_PREFIXES_B = (b"calc:", b"map:", b"kb:")
+_COMMAND_PATHS = frozenset(("/calculate", "/map", "/knowledge_base"))
+# 匹配JSON请求体开头的 {"prompt":" 部分，用于定位prompt值的起始位置
+_PROMPT_HEAD_RE = re.compile(rb'\s*\{\s*"prompt"\s*:\s*"')
+# 判断是否为放行命令时只需预读的请求体字节数
+_PEEK_BYTES = 64
+# 注入检测最多扫描的请求体字节数，超出部分由端点对实际prompt再做检测
+_SCAN_LIMIT = 64 * 1024
+
 
 # 创建FastAPI应用
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """应用生命周期管理"""
+    # 启动时一次性读取各服务密钥，缺失的只记录日志，对应功能在请求时返回错误
+    app.state.keys = {
+        "deepseek": os.getenv("DEEPSEEK_API_KEY"),
+        "qwen": os.getenv("QWEN_API_KEY"),
+        "amap": amap_integration.get_amap_key()
+    }
+    for name, key in app.state.keys.items():
+        if not key:
+            logger.warning(f"{name} API密钥未配置，相关功能不可用")
+
+    # 全局共享的HTTP客户端，复用连接池避免每次请求重新握手；HTTP/2下同一连接可承载多个并发请求
+    app.state.http = httpx.AsyncClient(
+        http2=True,
+        timeout=httpx.Timeout(10.0, connect=5.0, pool=5.0),
+        limits=httpx.Limits(max_keepalive_connections=64, max_connections=256, keepalive_expiry=30)
+    )
+
     model_path = BASE_DIR / "local_models" / "all-MiniLM-L6-v2"
     try:
         # 确保目录存在
@@ -77,6 +111,8 @@ async def lifespan(app: FastAPI):
     logger.info("清理知识库资源...")
     if hasattr(knowledge_base, 'knowledge_base') and knowledge_base.knowledge_base:
         knowledge_base.knowledge_base.release()
+    await app.state.http.aclose()
+    await llm_integration.aclose_http_clients()
 
 
 app = FastAPI(
@@ -85,7 +121,8 @@ app = FastAPI(
     version="1.0",
     docs_url="/docs",
     redoc_url=None,
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 
@@ -106,7 +143,8 @@ class ComparisonResult(BaseModel):
 
 # 流式响应端点
 @app.post("/generate", summary="流式响应生成")
-async def generate_stream(input: UserInput):
+async def generate_stream(input: UserInput, request: Request):
+    keys = request.app.state.keys
     try:
         raw_prompt = input.prompt.strip()
         parts = raw_prompt.split(maxsplit=1)
@@ -114,7 +152,7 @@ async def generate_stream(input: UserInput):
         actual_prompt = parts[1] if len(parts) > 1 else ""
 
         if first_word == "qwen":
-            if not QWEN_API_KEY:
+            if not keys["qwen"]:
                 raise HTTPException(500, "Qwen API Key未配置")
             clean_prompt = preprocessing.sanitize_input(actual_prompt)
             if preprocessing.detect_injection(clean_prompt):
@@ -124,9 +162,12 @@ async def generate_stream(input: UserInput):
                 prompt=clean_prompt,
                 temperature=input.temperature,
                 max_tokens=input.max_tokens,
-                api_key=QWEN_API_KEY
+                api_key=keys["qwen"],
+                client=request.app.state.http
             )
-            return StreamingResponse(stream_generator, media_type="text/event-stream")
+            # 同步生成器会被StreamingResponse逐块分派到线程池，必须是异步生成器
+            assert inspect.isasyncgen(stream_generator), "stream generator must be async"
+            return StreamingResponse(stream_generator, media_type="text/event-stream", headers=STREAM_HEADERS)
 
         else:
             # 默认调用 DeepSeek
@@ -140,9 +181,10 @@ async def generate_stream(input: UserInput):
                 prompt=clean_prompt,
                 temperature=input.temperature,
                 max_tokens=input.max_tokens,
-                api_key=API_KEY
+                api_key=keys["deepseek"]
             )
-            return StreamingResponse(stream_generator, media_type="text/event-stream")
+            assert inspect.isasyncgen(stream_generator), "stream generator must be async"
+            return StreamingResponse(stream_generator, media_type="text/event-stream", headers=STREAM_HEADERS)
 
     except HTTPException as he:
         raise he
@@ -153,7 +195,8 @@ async def generate_stream(input: UserInput):
 
 # 参数对比端点
 @app.post("/compare", summary="参数对比")
-async def compare_parameters(input: UserInput):
+async def compare_parameters(input: UserInput, request: Request):
+    keys = request.app.state.keys
     try:
         # 使用 provider 参数确定模型，而不是解析输入
         provider = input.provider.lower()
@@ -166,55 +209,64 @@ async def compare_parameters(input: UserInput):
         else:
             actual_prompt = raw_prompt
 
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            if provider == "qwen":
-                if not QWEN_API_KEY:
-                    raise HTTPException(500, "Qwen API Key未配置")
-                clean_prompt = preprocessing.sanitize_input(actual_prompt)
-                if preprocessing.detect_injection(clean_prompt):
-                    raise HTTPException(403, "检测到潜在安全威胁")
+        # 复用lifespan中创建的共享客户端，超时由各请求单独指定
+        client = request.app.state.http
+        if provider == "qwen":
+            if not keys["qwen"]:
+                raise HTTPException(500, "Qwen API Key未配置")
+            clean_prompt = preprocessing.sanitize_input(actual_prompt)
+            if preprocessing.detect_injection(clean_prompt):
+                raise HTTPException(403, "检测到潜在安全威胁")
 
-                low_temp = await qwen_integration.async_get_completion_qwen(
+            # 两个温度的请求并发执行
+            low_temp, high_temp = await asyncio.gather(
+                qwen_integration.async_get_completion_qwen(
                     prompt=clean_prompt,
                     temperature=0.7,
                     max_tokens=input.max_tokens,
-                    api_key=QWEN_API_KEY,
+                    api_key=keys["qwen"],
                     client=client
-                )
-                high_temp = await qwen_integration.async_get_completion_qwen(
+                ),
+                qwen_integration.async_get_completion_qwen(
                     prompt=clean_prompt,
                     temperature=1.2,
                     max_tokens=input.max_tokens,
-                    api_key=QWEN_API_KEY,
+                    api_key=keys["qwen"],
                     client=client
                 )
+            )
 
-            else:
-                clean_prompt = preprocessing.sanitize_input(actual_prompt)
+        else:
+            clean_prompt = preprocessing.sanitize_input(actual_prompt)
 
-                if preprocessing.detect_injection(clean_prompt):
-                    logger.warning(f"检测到指令注入: {clean_prompt[:50]}")
-                    raise HTTPException(403, "检测到潜在安全威胁")
+            if preprocessing.detect_injection(clean_prompt):
+                logger.warning(f"检测到指令注入: {clean_prompt[:50]}")
+                raise HTTPException(403, "检测到潜在安全威胁")
 
-                low_temp = await llm_integration.async_get_completion(
+            # 两个温度的请求并发执行
+            low_temp, high_temp = await asyncio.gather(
+                llm_integration.async_get_completion(
                     prompt=clean_prompt,
                     temperature=0.7,
                     max_tokens=input.max_tokens,
-                    api_key=API_KEY,
+                    api_key=keys["deepseek"],
                     client=client
-                )
-                high_temp = await llm_integration.async_get_completion(
+                ),
+                llm_integration.async_get_completion(
                     prompt=clean_prompt,
                     temperature=1.2,
                     max_tokens=input.max_tokens,
-                    api_key=API_KEY,
+                    api_key=keys["deepseek"],
                     client=client
                 )
+            )
 
-        analysis = f"温度参数对比分析 (0.7 vs 1.2):\n"
-        analysis += f"保守输出 (0.7): {low_temp[:100]}...\n"
-        analysis += f"创意输出 (1.2): {high_temp[:100]}...\n"
-        analysis += f"主要差异: {abs(len(low_temp) - len(high_temp))}字符长度差"
+        analysis = (
+            f"温度参数对比分析 (0.7 vs 1.2):\n"
+            f"保守输出 (0.7): {low_temp[:100]}...\n"
+            f"创意输出 (1.2): {high_temp[:100]}...\n"
+            f"主要差异: {abs(len(low_temp) - len(high_temp))}字符长度差"
+        )
 
         valid_low = output_validation.validate_output(low_temp)
         valid_high = output_validation.validate_output(high_temp)
@@ -266,28 +318,30 @@ async def calculate(input: UserInput):
 
 # 添加地图服务端点
 @app.post("/map")
-async def map_service(input: UserInput):
+async def map_service(input: UserInput, request: Request):
     """地图服务端点 - 改进版"""
     try:
+        client = request.app.state.http
+        amap_key = request.app.state.keys["amap"]
         # 解析地图指令
         command = amap_integration.AMapService.parse_map_command(input.prompt)
         
         # 处理不同类型的命令
         if command["type"] == "geocode":
-            result = await amap_integration.AMapService.geocode(command["address"])
-            return format_map_result(result)
+            result = await amap_integration.AMapService.geocode(command["address"], client, amap_key)
+            return ORJSONResponse(format_map_result(result))
         
         elif command["type"] == "reverse":
             result = await amap_integration.AMapService.reverse_geocode(
-                command["lng"], command["lat"]
+                command["lng"], command["lat"], client, amap_key
             )
-            return format_map_result(result)
+            return ORJSONResponse(format_map_result(result))
         
         elif command["type"] == "search":
             result = await amap_integration.AMapService.search_poi(
-                command["keyword"], command["city"]
+                command["keyword"], client, amap_key, command["city"]
             )
-            return format_map_result(result)
+            return ORJSONResponse(format_map_result(result))
         
         elif command["type"] == "error":
             return {"error": command["message"]}
@@ -307,6 +361,16 @@ async def map_service(input: UserInput):
         return {"error": f"地图服务失败: {str(e)}"}
 
 
+# 地图结果字段（英文键 -> 中文输出键），按输出顺序排列
+_GEOCODE_KEYS = (
+    ("formatted_address", "地址"), ("province", "省份"), ("city", "城市"), ("district", "区域")
+)
+_REVERSE_KEYS = (
+    ("formatted_address", "地址"), ("country", "国家"), ("province", "省份"),
+    ("city", "城市"), ("district", "区域"), ("street", "街道")
+)
+
+
 def format_map_result(result: dict) -> dict:
     """格式化地图服务结果"""
     if "error" in result:
@@ -315,41 +379,29 @@ def format_map_result(result: dict) -> dict:
     # 根据不同结果类型格式化输出
     if result["type"] == "geocode":
         res = result["result"]
-        return {
-            "type": "地址解析结果",
-            "查询": result["query"],
-            "地址": res["formatted_address"],
-            "省份": res["province"],
-            "城市": res["city"],
-            "区域": res["district"],
-            "坐标": f"经度: {res['longitude']}, 纬度: {res['latitude']}"
-        }
+        formatted = {"type": "地址解析结果", "查询": result["query"]}
+        formatted.update((cn, res[en]) for en, cn in _GEOCODE_KEYS)
+        formatted["坐标"] = f"经度: {res['longitude']}, 纬度: {res['latitude']}"
+        return formatted
     
     elif result["type"] == "reverse_geocode":
         res = result["result"]
-        return {
-            "type": "坐标解析结果",
-            "查询": result["query"],
-            "地址": res["formatted_address"],
-            "国家": res["country"],
-            "省份": res["province"],
-            "城市": res["city"],
-            "区域": res["district"],
-            "街道": res["street"]
-        }
+        formatted = {"type": "坐标解析结果", "查询": result["query"]}
+        formatted.update((cn, res[en]) for en, cn in _REVERSE_KEYS)
+        return formatted
     
     elif result["type"] == "poi_search":
-        results = []
-        for i, poi in enumerate(result["results"], 1):
-            results.append({
-                f"结果 {i}": {
-                    "名称": poi["name"],
-                    "地址": poi["address"],
-                    "坐标": f"经度: {poi['longitude']}, 纬度: {poi['latitude']}",
-                    "类型": poi["type"],
-                    "距离": poi["distance"]
-                }
-            })
+        # 结果直接为POI列表，序号由列表位置表示
+        results = [
+            {
+                "名称": poi["name"],
+                "地址": poi["address"],
+                "坐标": f"经度: {poi['longitude']}, 纬度: {poi['latitude']}",
+                "类型": poi["type"],
+                "距离": poi["distance"]
+            }
+            for poi in result["results"]
+        ]
         
         return {
             "type": "地点搜索结果",
@@ -370,20 +422,21 @@ async def knowledge_base_search(input: UserInput):
         # 移除可能的命令前缀
         query = input.prompt.replace("kb:", "").strip()
 
-        # 检索知识库
-        results = knowledge_base.knowledge_base.search(query, top_k=3)
+        # 检索知识库（向量编码与FAISS检索较耗CPU，放到线程中执行以免阻塞事件循环）
+        results = await asyncio.to_thread(knowledge_base.knowledge_base.search, query, top_k=3)
 
         # 格式化结果
         formatted_results = []
         for content, meta, score in results:
             formatted_results.append({
-                "content": content[:500] + "..." if len(content) > 500 else content,
+                "content": f"{content[:KB_PREVIEW_LENGTH]}..." if len(content) > KB_PREVIEW_LENGTH else content,
                 "source": meta.get("source", "未知"),
                 "page": meta.get("page", 0),
                 "score": round(score, 3)
             })
 
-        return {"results": formatted_results}
+        # 直接返回ORJSONResponse，跳过jsonable_encoder
+        return ORJSONResponse({"results": formatted_results})
 
     except Exception as e:
         logger.exception("知识库检索过程中出错")
@@ -392,42 +445,85 @@ async def knowledge_base_search(input: UserInput):
 
 
 # 修改安全中间件
-@app.middleware("http")
-async def security_middleware(request: Request, call_next):
-    """全局安全中间件"""
-    try:
+class SecurityMiddleware:
+    """全局安全中间件（纯ASGI实现）
+
+    只预读请求体开头几十个字节判断是否为放行命令，命中则不再缓冲整个请求体；
+    已读取的消息通过包装后的receive原样回放给下游。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
         # 只检查POST请求
-        if request.method == "POST":
-            # 获取请求体
-            body_bytes = await request.body()
-            body_str = body_bytes.decode("utf-8")
-
-            # 检查是否是我们允许的功能命令
-            allowed_prefixes = ["calc:", "map:", "kb:"]
-            if any(body_str.startswith(prefix) for prefix in allowed_prefixes):
-                # 放行允许的命令
-                request._body = body_bytes
-                return await call_next(request)
-
-            # 指令注入防护
-            if preprocessing.detect_injection(body_str):
-                logger.warning(f"中间件检测到注入: {body_str[:100]}")
-                return JSONResponse(
-                    status_code=403,
-                    content={"error": "检测到潜在安全威胁"}
-                )
+        if scope["type"] != "http" or scope["method"] != "POST":
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            messages = []
+            body = bytearray()
+            more_body = True
+
+            # 预读请求体开头部分
+            while more_body and len(body) < _PEEK_BYTES:
+                message = await receive()
+                messages.append(message)
+                if message["type"] != "http.request":
+                    break
+                body += message.get("body", b"")
+                more_body = message.get("more_body", False)
+
+            # 检查是否是我们允许的功能命令（字节级前缀比较，无需解码）；
+            # 只在功能命令端点放行，避免/generate等LLM端点借命令前缀绕过检测
+            is_command = False
+            if scope["path"] in _COMMAND_PATHS:
+                head = _PROMPT_HEAD_RE.match(body)
+                offset = head.end() if head else 0
+                is_command = body.startswith(_ALLOWED_PREFIXES_B, offset)
+            if not is_command:
+                # 注入检测最多读取前64KiB，其余部分留给下游按流读取
+                while more_body and len(body) < _SCAN_LIMIT:
+                    message = await receive()
+                    messages.append(message)
+                    if message["type"] != "http.request":
+                        break
+                    body += message.get("body", b"")
+                    more_body = message.get("more_body", False)
+
+                # 仅在需要注入检测时才解码
+                body_str = body[:_SCAN_LIMIT].decode("utf-8", "replace")
+
+                # 指令注入防护
+                if preprocessing.detect_injection(body_str):
+                    logger.warning(f"中间件检测到注入: {body_str[:100]}")
+                    response = JSONResponse(
+                        status_code=403,
+                        content={"error": "检测到潜在安全威胁"}
+                    )
+                    await response(scope, receive, send)
+                    return
+
+        except Exception:
+            logger.exception("安全中间件出错")
+            response = JSONResponse(
+                status_code=500,
+                content={"error": "服务器内部错误"}
+            )
+            await response(scope, receive, send)
+            return
 
-            # 将body放回请求中（因为已经读取过）
-            request._body = body_bytes
+        # 先回放已读取的消息，再继续读取原始请求流
+        async def replay_receive():
+            if messages:
+                return messages.pop(0)
+            return await receive()
 
-        return await call_next(request)
+        await self.app(scope, replay_receive, send)
 
-    except Exception:
-        logger.exception("安全中间件出错")
-        return JSONResponse(
-            status_code=500,
-            content={"error": "服务器内部错误"}
-        )
+
+app.add_middleware(SecurityMiddleware)
 
 
 # 健康检查端点
@@ -1,147 +1,225 @@
 # modules/amap_integration.py - 高德地图API集成
 import os
+import time
+import asyncio
 import logging
+import functools
 import httpx
-from typing import Dict, List, Optional
+import orjson
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional
 import re
 
 logger = logging.getLogger("amap_integration")
 
 # 高德地图API配置
 AMAP_API_BASE = "https://restapi.amap.com/v3"
+# 单次请求超时（秒），按请求传入共享客户端
+AMAP_TIMEOUT = 10.0
 
+# 预编译指令解析用的正则
+_COORD_RE = re.compile(r"(-?\d+\.\d+)[,，\s]+(-?\d+\.\d+)")
+_CMD_PREFIX_RE = re.compile(r"^(geocode|reverse|search)", re.I)
 
-def get_amap_key():
-    """延迟获取API密钥，确保.env已加载"""
+
+class _AsyncTTLCache:
+    """异步LRU+TTL缓存：只缓存成功结果，相同key的并发请求合并为一次上游调用"""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[tuple, tuple]" = OrderedDict()  # key -> (过期时间, 结果)
+        self._inflight: Dict[tuple, asyncio.Future] = {}
+
+    async def get_or_fetch(self, key: tuple, fetch: Callable[[], Awaitable[Dict]]) -> Dict:
+        entry = self._data.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self._data.move_to_end(key)
+                return entry[1]
+            del self._data[key]
+
+        # 已有相同请求在进行中，等待其结果
+        pending = self._inflight.get(key)
+        if pending is not None:
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise
+                # 发起请求的协程被取消，由当前协程重新获取
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await fetch()
+        except BaseException:
+            future.cancel()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+        if result and "error" not in result:
+            self._data[key] = (time.monotonic() + self.ttl, result)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        future.set_result(result)
+        return result
+
+
+# 地图查询结果缓存（地址/坐标/关键词在会话内基本不会变化）
+_GEOCODE_CACHE = _AsyncTTLCache(maxsize=1024, ttl=3600)
+_REVERSE_CACHE = _AsyncTTLCache(maxsize=1024, ttl=3600)
+_POI_CACHE = _AsyncTTLCache(maxsize=1024, ttl=3600)
+
+
+@functools.lru_cache(maxsize=1)
+def get_amap_key() -> Optional[str]:
+    """延迟获取API密钥，确保.env已加载；首次读取后缓存"""
     return os.getenv("AMAP_API_KEY")
 
 
 class AMapService:
     @staticmethod
-    async def geocode(address: str) -> Optional[Dict]:
+    async def geocode(address: str, client: httpx.AsyncClient, api_key: str) -> Optional[Dict]:
+        """地理编码：地址转坐标（带缓存）"""
+        return await _GEOCODE_CACHE.get_or_fetch(
+            (address,), lambda: AMapService._geocode(address, client, api_key)
+        )
+
+    @staticmethod
+    async def reverse_geocode(lng: float, lat: float, client: httpx.AsyncClient, api_key: str) -> Optional[Dict]:
+        """逆地理编码：坐标转地址（带缓存）"""
+        return await _REVERSE_CACHE.get_or_fetch(
+            (lng, lat), lambda: AMapService._reverse_geocode(lng, lat, client, api_key)
+        )
+
+    @staticmethod
+    async def search_poi(keyword: str, client: httpx.AsyncClient, api_key: str, city: str = "") -> Optional[Dict]:
+        """地点搜索（带缓存）"""
+        return await _POI_CACHE.get_or_fetch(
+            (keyword, city), lambda: AMapService._search_poi(keyword, client, api_key, city)
+        )
+
+    @staticmethod
+    async def _geocode(address: str, client: httpx.AsyncClient, api_key: str) -> Optional[Dict]:
         """地理编码：地址转坐标"""
-        amap_api_key = get_amap_key()
-        if not amap_api_key:
+        if not api_key:
             return {"error": "地图服务配置错误：请设置AMAP_API_KEY环境变量"}
 
         url = f"{AMAP_API_BASE}/geocode/geo"
         params = {
-            "key": amap_api_key,
+            "key": api_key,
             "address": address,
             "output": "JSON"
         }
 
         try:
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                response = await client.get(url, params=params)
-                response.raise_for_status()
-                data = response.json()
-
-                if data["status"] == "1" and data["geocodes"]:
-                    location = data["geocodes"][0]["location"].split(",")
-                    # 格式化输出
-                    return {
-                        "type": "geocode",
-                        "query": address,
-                        "result": {
-                            "formatted_address": data["geocodes"][0].get("formatted_address", "未知"),
-                            "province": data["geocodes"][0].get("province", "未知"),
-                            "city": data["geocodes"][0].get("city", "未知"),
-                            "district": data["geocodes"][0].get("district", "未知"),
-                            "longitude": float(location[0]),
-                            "latitude": float(location[1])
-                        }
+            response = await client.get(url, params=params, timeout=AMAP_TIMEOUT)
+            response.raise_for_status()
+            data = orjson.loads(response.content)
+
+            if data["status"] == "1" and data["geocodes"]:
+                location = data["geocodes"][0]["location"].split(",")
+                # 格式化输出
+                return {
+                    "type": "geocode",
+                    "query": address,
+                    "result": {
+                        "formatted_address": data["geocodes"][0].get("formatted_address", "未知"),
+                        "province": data["geocodes"][0].get("province", "未知"),
+                        "city": data["geocodes"][0].get("city", "未知"),
+                        "district": data["geocodes"][0].get("district", "未知"),
+                        "longitude": float(location[0]),
+                        "latitude": float(location[1])
                     }
-                return {"error": f"未找到与'{address}'相关的位置信息"}
+                }
+            return {"error": f"未找到与'{address}'相关的位置信息"}
         except Exception as e:
             logger.error(f"地理编码失败: {str(e)}")
             return {"error": f"地图服务暂时不可用，请稍后再试 ({str(e)})"}
 
     @staticmethod
-    async def reverse_geocode(lng: float, lat: float) -> Optional[Dict]:
+    async def _reverse_geocode(lng: float, lat: float, client: httpx.AsyncClient, api_key: str) -> Optional[Dict]:
         """逆地理编码：坐标转地址"""
-        amap_api_key = get_amap_key()
-        if not amap_api_key:
+        if not api_key:
             return {"error": "地图服务配置错误：请设置AMAP_API_KEY环境变量"}
 
         url = f"{AMAP_API_BASE}/geocode/regeo"
         params = {
-            "key": amap_api_key,
+            "key": api_key,
             "location": f"{lng},{lat}",
             "extensions": "base",
             "output": "JSON"
         }
 
         try:
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                response = await client.get(url, params=params)
-                response.raise_for_status()
-                data = response.json()
-
-                if data["status"] == "1":
-                    address = data["regeocode"]["addressComponent"]
-                    # 格式化输出
-                    return {
-                        "type": "reverse_geocode",
-                        "query": f"{lng},{lat}",
-                        "result": {
-                            "formatted_address": data["regeocode"].get("formatted_address", "未知"),
-                            "country": address.get("country", "未知"),
-                            "province": address.get("province", "未知"),
-                            "city": address.get("city", address.get("province", "未知")),
-                            "district": address.get("district", "未知"),
-                            "township": address.get("township", "未知"),
-                            "street": f"{address['streetNumber'].get('street', '')} {address['streetNumber'].get('number', '')}".strip()
-                        }
+            response = await client.get(url, params=params, timeout=AMAP_TIMEOUT)
+            response.raise_for_status()
+            data = orjson.loads(response.content)
+
+            if data["status"] == "1":
+                address = data["regeocode"]["addressComponent"]
+                # 格式化输出
+                return {
+                    "type": "reverse_geocode",
+                    "query": f"{lng},{lat}",
+                    "result": {
+                        "formatted_address": data["regeocode"].get("formatted_address", "未知"),
+                        "country": address.get("country", "未知"),
+                        "province": address.get("province", "未知"),
+                        "city": address.get("city", address.get("province", "未知")),
+                        "district": address.get("district", "未知"),
+                        "township": address.get("township", "未知"),
+                        "street": f"{address['streetNumber'].get('street', '')} {address['streetNumber'].get('number', '')}".strip()
                     }
-                return {"error": f"未找到坐标({lng},{lat})对应的地址信息"}
+                }
+            return {"error": f"未找到坐标({lng},{lat})对应的地址信息"}
         except Exception as e:
             logger.error(f"逆地理编码失败: {str(e)}")
             return {"error": f"地图服务暂时不可用，请稍后再试 ({str(e)})"}
 
     @staticmethod
-    async def search_poi(keyword: str, city: str = "") -> Optional[Dict]:
+    async def _search_poi(keyword: str, client: httpx.AsyncClient, api_key: str, city: str = "") -> Optional[Dict]:
         """地点搜索"""
-        amap_api_key = get_amap_key()
-        if not amap_api_key:
+        if not api_key:
             return {"error": "地图服务配置错误：请设置AMAP_API_KEY环境变量"}
 
         url = f"{AMAP_API_BASE}/place/text"
         params = {
-            "key": amap_api_key,
+            "key": api_key,
             "keywords": keyword,
             "city": city,
             "output": "JSON"
         }
 
         try:
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                response = await client.get(url, params=params)
-                response.raise_for_status()
-                data = response.json()
-
-                if data["status"] == "1" and data["pois"]:
-                    # 格式化结果
-                    results = []
-                    for poi in data["pois"][:5]:  # 最多返回5个结果
-                        location = poi["location"].split(",")
-                        results.append({
-                            "name": poi.get("name", "未知地点"),
-                            "address": poi.get("address", "未知地址"),
-                            "longitude": float(location[0]),
-                            "latitude": float(location[1]),
-                            "type": poi.get("type", "未知类型"),
-                            "distance": f"{int(poi.get('distance', 0))}米" if poi.get("distance") else "未知距离"
-                        })
-                    
-                    return {
-                        "type": "poi_search",
-                        "query": keyword,
-                        "city": city if city else "全国范围",
-                        "count": len(results),
-                        "results": results
-                    }
-                return {"error": f"未找到与'{keyword}'相关的地点"}
+            response = await client.get(url, params=params, timeout=AMAP_TIMEOUT)
+            response.raise_for_status()
+            data = orjson.loads(response.content)
+
+            if data["status"] == "1" and data["pois"]:
+                # 格式化结果
+                results = []
+                for poi in data["pois"][:5]:  # 最多返回5个结果
+                    location = poi["location"].split(",")
+                    results.append({
+                        "name": poi.get("name", "未知地点"),
+                        "address": poi.get("address", "未知地址"),
+                        "longitude": float(location[0]),
+                        "latitude": float(location[1]),
+                        "type": poi.get("type", "未知类型"),
+                        "distance": f"{int(poi.get('distance', 0))}米" if poi.get("distance") else "未知距离"
+                    })
+                
+                return {
+                    "type": "poi_search",
+                    "query": keyword,
+                    "city": city if city else "全国范围",
+                    "count": len(results),
+                    "results": results
+                }
+            return {"error": f"未找到与'{keyword}'相关的地点"}
         except Exception as e:
             logger.error(f"地点搜索失败: {str(e)}")
             return {"error": f"地图服务暂时不可用，请稍后再试 ({str(e)})"}
@@ -152,25 +230,14 @@ class AMapService:
         logger.info(f"解析地图指令: {prompt}")
         
         # 清理指令
-        clean_prompt = prompt.replace("map:", "").strip()
+        clean_prompt = prompt.lstrip().removeprefix("map:").strip()
         if not clean_prompt:
             return {"type": "help"}
         
-        # 识别指令类型
-        command_types = {
-            "geocode": "地理编码",
-            "reverse": "逆地理编码",
-            "search": "地点搜索"
-        }
-        
-        # 尝试匹配指令类型
-        command_type = None
-        for cmd in command_types:
-            if clean_prompt.lower().startswith(cmd):
-                command_type = cmd
-                break
+        # 识别指令类型：geocode(地理编码) / reverse(逆地理编码) / search(地点搜索)
+        match = _CMD_PREFIX_RE.match(clean_prompt)
         
-        if not command_type:
+        if not match:
             # 自动识别指令类型
             if "坐标" in clean_prompt or "位置" in clean_prompt or "定位" in clean_prompt:
                 return {"type": "reverse", "message": "请提供坐标信息，例如：116.397428,39.90923"}
@@ -180,7 +247,8 @@ class AMapService:
                 return {"type": "geocode", "message": "请提供地址信息，例如：北京市海淀区中关村"}
         
         # 提取参数
-        arguments = clean_prompt[len(command_type):].strip()
+        command_type = match.group(1).lower()
+        arguments = clean_prompt[match.end():].strip()
         
         if command_type == "geocode":
             if not arguments:
@@ -192,8 +260,7 @@ class AMapService:
                 return {"type": "error", "message": "请提供坐标信息，例如：116.397428,39.90923"}
             
             # 尝试提取坐标
-            coord_pattern = r"(-?\d+\.\d+)[,，\s]+(-?\d+\.\d+)"
-            match = re.search(coord_pattern, arguments)
+            match = _COORD_RE.search(arguments)
             if match:
                 try:
                     lng = float(match.group(1))
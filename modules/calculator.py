@@ -1,12 +1,94 @@
 # modules/calculator.py - 安全数学表达式计算器
+import ast
 import math
 import re
 import logging
+import operator
+import functools
 import cmath
+import numpy as np
 from typing import Optional, Union
 
 logger = logging.getLogger("calculator")
 
+# 计算请求关键词、表达式中禁止出现的危险关键字
+CALCULATION_KEYWORDS = ["计算", "算一下", "等于多少", "=?", "calculate", "compute", "what is"]
+DANGER_KEYWORDS = ["__", "import", "open", "exec", "eval", "lambda", "class"]
+
+# 预编译的正则（避免每次调用重新编译/查找缓存）
+# 关键词合并为单个忽略大小写的分支正则，一次扫描完成匹配
+_CALC_KW_RE = re.compile("|".join(map(re.escape, CALCULATION_KEYWORDS)), re.IGNORECASE)
+_DANGER_KW_RE = re.compile("|".join(map(re.escape, DANGER_KEYWORDS)), re.IGNORECASE)
+# 数学表达式模式（用于识别计算请求）
+_CALC_PATTERNS = [
+    re.compile(pattern, re.IGNORECASE) for pattern in (
+        r"\d+\s*[-+*/%^]\s*\d+",
+        r"^[-+*/%^]\s*\d+",
+        r"sqrt\(.+\)",
+        r"sin\(.+\)",
+        r"log\(.+\)",
+        r"\d+\s*=\s*\?",
+        r"[\d.]+[+\-*/^][\d.]+",
+        r"^[\d()+\-*/^.a-z]+$",
+    )
+]
+# 表达式清理：移除非数学符号（纯ASCII输入用translate删除表，含π等字符时用正则）
+_EXPR_STRIP_RE = re.compile(r"[^0-9a-zA-Z.\-+*/^%()π\s,]")
+_EXPR_ALLOWED = frozenset("0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ.-+*/^%(),")
+_EXPR_DROP_TABLE = {i: None for i in range(128) if not (chr(i) in _EXPR_ALLOWED or chr(i).isspace())}
+# 函数调用名
+_FUNC_CALL_RE = re.compile(r"([a-zA-Z]+)\(")
+
+# 表达式长度达到该值时改用NumPy向量化检查括号平衡（短表达式用纯Python更快）
+_PAREN_VECTOR_THRESHOLD = 256
+
+
+def _parens_balanced(expr: str) -> bool:
+    """检查括号是否平衡：数量相等且任意前缀中右括号不多于左括号"""
+    if expr.count('(') != expr.count(')'):
+        return False
+
+    if len(expr) >= _PAREN_VECTOR_THRESHOLD:
+        buf = np.frombuffer(expr.encode('ascii', 'ignore'), dtype=np.uint8)
+        depth = np.cumsum((buf == 40).view(np.int8) - (buf == 41).view(np.int8), dtype=np.int32)
+        return not (depth < 0).any()
+
+    depth = 0
+    for char in expr:
+        depth += (char == '(') - (char == ')')
+        if depth < 0:
+            return False
+    return True
+
+
+@functools.lru_cache(maxsize=1024)
+def _compile_expr(src: str):
+    """编译表达式为代码对象并缓存，重复表达式无需再次解析"""
+    return compile(src, "<calc>", "eval")
+
+
+# 直接遍历AST时支持的运算符
+_AST_BIN_OPS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Pow: operator.pow,
+    ast.Mod: operator.mod
+}
+_AST_UNARY_OPS = {ast.USub: operator.neg, ast.UAdd: operator.pos}
+
+
+class _UnsupportedNode(Exception):
+    """AST中出现直接遍历不支持的节点，需回退到eval"""
+
+
+@functools.lru_cache(maxsize=1024)
+def _parse_expr(src: str) -> ast.expr:
+    """解析表达式为AST并缓存"""
+    return ast.parse(src, filename="<calc>", mode="eval").body
+
 
 class Calculator:
     """安全数学表达式计算器"""
@@ -58,35 +140,23 @@ class Calculator:
             'complex': lambda a, b: complex(a, b)
         }
 
+        # eval使用的安全环境：一次构建，禁用内置函数
+        self._safe_env = {**self.safe_functions, '__builtins__': None}
+
+        # 安全环境中只有纯函数和常量，相同表达式的结果按表达式缓存
+        self._eval_cached = functools.lru_cache(maxsize=1024)(self._eval)
+
     def is_calculation_request(self, text: str) -> bool:
         """检测是否为计算请求"""
         if not text:
             return False
 
-        # 检测计算请求的关键词
-        calculation_keywords = [
-            "计算", "算一下", "等于多少", "=?",
-            "calculate", "compute", "what is", "=?"
-        ]
-
-        # 检测数学表达式模式
-        math_patterns = [
-            r"\d+\s*[-+*/%^]\s*\d+",
-            r"^[-+*/%^]\s*\d+",
-            r"sqrt\(.+\)",
-            r"sin\(.+\)",
-            r"log\(.+\)",
-            r"\d+\s*=\s*\?",
-            r"[\d.]+[+\-*/^][\d.]+",
-            r"^[\d()+\-*/^.a-z]+$",
-        ]
-
         # 检查关键词
-        if any(keyword in text.lower() for keyword in calculation_keywords):
+        if _CALC_KW_RE.search(text) is not None:
             return True
 
         # 检查数学模式
-        if any(re.search(pattern, text, re.IGNORECASE) for pattern in math_patterns):
+        if any(pattern.search(text) for pattern in _CALC_PATTERNS):
             return True
 
         return False
@@ -98,10 +168,13 @@ class Calculator:
         """安全评估数学表达式"""
         try:
             # 清理表达式 - 保留更多数学符号
-            clean_expr = re.sub(r"[^0-9a-zA-Z.\-+*/^%()π\s,]", "", expression)
+            if expression.isascii():
+                clean_expr = expression.translate(_EXPR_DROP_TABLE)
+            else:
+                clean_expr = _EXPR_STRIP_RE.sub("", expression)
 
             # 保留必要空格，仅压缩多余空格
-            clean_expr = re.sub(r"\s+", " ", clean_expr).strip()
+            clean_expr = " ".join(clean_expr.split())
 
             # 替换常见数学符号
             clean_expr = clean_expr.replace("π", "pi").replace("^", "**")
@@ -111,61 +184,11 @@ class Calculator:
                 logger.warning(f"检测到不安全表达式: {expression}")
                 return None
 
-            # 创建安全环境 - 修复变量引用问题
-            safe_env = {
-                # 基础数学函数
-                'sqrt': math.sqrt,
-                'cbrt': lambda x: x ** (1 / 3),
-                'sin': math.sin,
-                'cos': math.cos,
-                'tan': math.tan,
-                'asin': math.asin,
-                'acos': math.acos,
-                'atan': math.atan,
-                'log': math.log,
-                'log10': math.log10,
-                'log2': math.log2,
-                'exp': math.exp,
-                'abs': abs,
-                'round': round,
-                'ceil': math.ceil,
-                'floor': math.floor,
-                'factorial': math.factorial,
-                
-                # 双曲函数
-                'sinh': math.sinh,
-                'cosh': math.cosh,
-                'tanh': math.tanh,
-                
-                # 统计函数
-                'hypot': math.hypot,
-                'gcd': math.gcd,
-                'lcm': lambda a, b: abs(a * b) // math.gcd(a, b) if a and b else 0,
-                
-                # 常量
-                'pi': math.pi,
-                'e': math.e,
-                'tau': math.tau,
-                'inf': float('inf'),
-                'nan': float('nan'),
-                
-                # 复数支持
-                'phase': cmath.phase,
-                'polar': cmath.polar,
-                'rect': cmath.rect,
-                'csqrt': cmath.sqrt,
-                'complex': lambda a, b: complex(a, b),
-                
-                # 安全基础
-                '__builtins__': None
-            }
-
-            # 使用eval执行计算
-            result = eval(clean_expr, safe_env)
-
             # 添加详细日志
             logger.info(f"计算表达式: {clean_expr}")
-            result = eval(clean_expr, safe_env)
+
+            # 执行表达式（重复表达式直接命中结果缓存）
+            result = self._eval_cached(clean_expr)
             logger.info(f"计算结果: {result}")
 
             # 处理特殊值
@@ -209,27 +232,48 @@ class Calculator:
             logger.exception(f"计算错误详情: {expression}")  # 添加详细异常日志
             return None
 
+    def _eval(self, clean_expr: str):
+        """执行表达式（需已通过安全验证）：优先直接遍历AST，遇到不支持的语法回退到eval"""
+        try:
+            return self._walk(_parse_expr(clean_expr))
+        except (_UnsupportedNode, RecursionError):
+            return eval(_compile_expr(clean_expr), self._safe_env)
+
+    def _walk(self, node: ast.AST):
+        """按节点类型直接计算：数字常量、四则/幂/取模运算、正负号、安全函数及常量"""
+        node_type = type(node)
+        if node_type is ast.Constant:
+            if type(node.value) in (int, float, complex):
+                return node.value
+        elif node_type is ast.BinOp:
+            op = _AST_BIN_OPS.get(type(node.op))
+            if op is not None:
+                return op(self._walk(node.left), self._walk(node.right))
+        elif node_type is ast.UnaryOp:
+            op = _AST_UNARY_OPS.get(type(node.op))
+            if op is not None:
+                return op(self._walk(node.operand))
+        elif node_type is ast.Name:
+            if node.id in self.safe_functions:
+                return self.safe_functions[node.id]
+        elif node_type is ast.Call and type(node.func) is ast.Name and not node.keywords:
+            func = self.safe_functions.get(node.func.id)
+            if func is not None:
+                return func(*[self._walk(arg) for arg in node.args])
+        raise _UnsupportedNode(node_type.__name__)
+
     def _validate_expression(self, expr: str) -> bool:
         """验证表达式是否安全"""
         # 禁止危险关键字
-        danger_keywords = ["__", "import", "open", "exec", "eval", "lambda", "class"]
-        if any(keyword in expr.lower() for keyword in danger_keywords):
+        if _DANGER_KW_RE.search(expr) is not None:
             return False
 
         # 检查括号平衡
-        stack = []
-        for char in expr:
-            if char == '(':
-                stack.append(char)
-            elif char == ')':
-                if not stack:
-                    return False
-                stack.pop()
-        if stack:
+        if not _parens_balanced(expr):
             return False
 
         # 修复：函数名大小写不敏感验证
-        func_calls = re.findall(r"([a-zA-Z]+)\(", expr)
+        func_calls = _FUNC_CALL_RE.findall(expr)
         safe_funcs_lower = [name.lower() for name in self.safe_functions]
         
         for func in set(func_calls):
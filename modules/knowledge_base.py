@@ -1,16 +1,30 @@
 # modules/knowledge_base.py - 知识库处理
 import os
 import sys
+import hashlib
+import threading
+from collections import OrderedDict
 from pathlib import Path
 import logging
 import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
 from PyPDF2 import PdfReader
 from docx import Document
 from sentence_transformers import SentenceTransformer
 import faiss
-from typing import List, Tuple, Dict, Callable, Optional
+from .pdf_extraction import extract_pages, extract_pdf_pages, get_pool, reset_pool
+from typing import List, Tuple, Dict, Callable, Optional, Set
 import re
 
+# 可选：ONNX Runtime推理（未安装时使用SentenceTransformer）
+try:
+    from optimum.onnxruntime import ORTModelForFeatureExtraction
+    from transformers import AutoTokenizer
+    import onnxruntime as ort
+except ImportError:
+    ORTModelForFeatureExtraction = None
+
 # 获取项目根目录
 BASE_DIR = Path(__file__).parent.parent
 sys.path.insert(0, str(BASE_DIR))
@@ -21,7 +35,62 @@ logger = logging.getLogger("knowledge_base")
 CHUNK_SIZE = 512
 OVERLAP_SIZE = 50
 EMBEDDING_MODEL = "local_models/all-MiniLM-L6-v2"
+ENCODE_BATCH_SIZE = 64
+# INT8量化的ONNX模型目录（模型目录下的子目录），一次性导出：
+#   optimum-cli export onnx --model local_models/all-MiniLM-L6-v2 --task feature-extraction local_models/all-MiniLM-L6-v2/onnx/
+#   再用 optimum.onnxruntime.ORTQuantizer 做动态int8量化，输出 model_quantized.onnx
+ONNX_SUBDIR = "onnx"
+ONNX_MODEL_FILE = "model_quantized.onnx"
+# 与sentence_bert_config.json中的max_seq_length一致
+MAX_SEQ_LENGTH = 256
+# 检索结果缓存条数（按 (query, top_k) 缓存，索引变更时清空）
+SEARCH_CACHE_SIZE = 512
+# HNSW图索引参数（每个节点的邻居数、检索时的候选队列长度）
+HNSW_M = 32
+HNSW_EF_SEARCH = 64
 SUPPORTED_EXTENSIONS = {".pdf", ".txt", ".docx"}
+# 分块边界字符（句号、分号等）
+_BOUNDARY_RE = re.compile(r"[.。;；!！?？\n]")
+# PDF页数达到该值时使用多进程并行提取文本（页数少时进程间传输与调度开销大于收益）
+PDF_PARALLEL_MIN_PAGES = 50
+
+
+def _chunk_hash(text: str) -> bytes:
+    """文本块指纹，用于去重"""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+class OnnxEncoder:
+    """基于ONNX Runtime的句向量编码器，与SentenceTransformer.encode接口一致（均值池化）"""
+
+    def __init__(self, onnx_dir: Path, tokenizer_dir: Path):
+        session_options = ort.SessionOptions()
+        session_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.model = ORTModelForFeatureExtraction.from_pretrained(
+            str(onnx_dir), file_name=ONNX_MODEL_FILE, session_options=session_options
+        )
+        self.tokenizer = AutoTokenizer.from_pretrained(str(tokenizer_dir))
+
+    def encode(self, texts: List[str], batch_size: int = 32, show_progress_bar: bool = False,
+               convert_to_numpy: bool = True, normalize_embeddings: bool = False) -> np.ndarray:
+        outputs = []
+        for start in range(0, len(texts), batch_size):
+            inputs = self.tokenizer(
+                texts[start:start + batch_size],
+                padding=True,
+                truncation=True,
+                max_length=MAX_SEQ_LENGTH,
+                return_tensors="np"
+            )
+            hidden = self.model(**inputs).last_hidden_state
+            mask = inputs["attention_mask"][..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            if normalize_embeddings:
+                pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            outputs.append(pooled.astype(np.float32, copy=False))
+        if not outputs:
+            return np.empty((0, self.model.config.hidden_size), dtype=np.float32)
+        return np.concatenate(outputs)
 
 
 class KnowledgeBase:
@@ -44,7 +113,7 @@ class KnowledgeBase:
             raise RuntimeError(f"模型路径不存在: {model_path}")
 
         try:
-            self.model = SentenceTransformer(str(model_path))
+            self.model = self._load_model(model_path)
             logger.info(f"成功加载模型: {model_path}")
         except Exception as e:
             logger.error(f"模型加载失败: {str(e)}")
@@ -54,6 +123,11 @@ class KnowledgeBase:
         self.documents: List[str] = []
         self.metadata: List[Dict] = []
         self.dimension: Optional[int] = None
+        # 已入库文本块的指纹，避免重复文本重复编码、重复入库
+        self._chunk_hashes: Set[bytes] = set()
+        # 检索结果LRU缓存（search在线程池中执行，需加锁）
+        self._search_cache: "OrderedDict[Tuple[str, int], List[Tuple[str, dict, float]]]" = OrderedDict()
+        self._search_cache_lock = threading.Lock()
 
         # 文件处理器注册
         self.file_handlers: Dict[str, Callable] = {
@@ -62,14 +136,34 @@ class KnowledgeBase:
             ".docx": self._handle_docx
         }
 
+    @staticmethod
+    def _load_model(model_path: Path):
+        """优先加载INT8量化的ONNX模型，不可用时回退到SentenceTransformer"""
+        onnx_dir = model_path / ONNX_SUBDIR
+        if ORTModelForFeatureExtraction is not None and (onnx_dir / ONNX_MODEL_FILE).exists():
+            try:
+                encoder = OnnxEncoder(onnx_dir, model_path)
+                logger.info(f"使用ONNX Runtime推理: {onnx_dir / ONNX_MODEL_FILE}")
+                return encoder
+            except Exception as e:
+                logger.warning(f"ONNX模型加载失败，回退到SentenceTransformer: {str(e)}")
+        return SentenceTransformer(str(model_path))
+
     def release(self):
         """释放资源"""
         self.index = None
         self.documents = []
         self.metadata = []
         self.dimension = None
+        self._chunk_hashes = set()
+        self._clear_search_cache()
         logger.info("知识库资源已释放")
 
+    def _clear_search_cache(self):
+        """索引内容变化后清空检索缓存"""
+        with self._search_cache_lock:
+            self._search_cache.clear()
+
     def load_document(self, file_path: str) -> List[Tuple[str, dict]]:
         if not os.path.exists(file_path):
             logger.error(f"文件不存在: {file_path}")
@@ -94,17 +188,35 @@ class KnowledgeBase:
             return []
 
     def _handle_pdf(self, file_path: str) -> List[Tuple[str, dict]]:
-        """处理PDF文件"""
-        chunks = []
+        """处理PDF文件（页数较多时多进程并行提取文本）"""
         with open(file_path, "rb") as f:
             reader = PdfReader(f)
-            for page_num, page in enumerate(reader.pages):
+            page_count = len(reader.pages)
+            pages = None
+
+            if page_count >= PDF_PARALLEL_MIN_PAGES:
+                workers = min(os.cpu_count() or 1, page_count)
+                size = -(-page_count // workers)
+                batches = [list(range(start, min(start + size, page_count))) for start in range(0, page_count, size)]
                 try:
-                    text = page.extract_text()
-                    if text:
-                        chunks.extend(self._chunk_text(text, file_path, page_num))
+                    pages = [
+                        page
+                        for batch in get_pool().map(extract_pdf_pages, [file_path] * len(batches), batches)
+                        for page in batch
+                    ]
                 except Exception as e:
-                    logger.warning(f"PDF页面提取失败: {file_path} 页码 {page_num}, 错误: {str(e)}")
+                    reset_pool()
+                    logger.warning(f"PDF并行提取失败，改为逐页提取: {file_path}, 错误: {str(e)}")
+
+            if pages is None:
+                pages = extract_pages(reader, list(range(page_count)))
+
+        chunks = []
+        for page_num, text, error in pages:
+            if error is not None:
+                logger.warning(f"PDF页面提取失败: {file_path} 页码 {page_num}, 错误: {error}")
+            elif text:
+                chunks.extend(self._chunk_text(text, file_path, page_num))
         return chunks
 
     def _handle_text(self, file_path: str) -> List[Tuple[str, dict]]:
@@ -116,7 +228,7 @@ class KnowledgeBase:
     def _handle_docx(self, file_path: str) -> List[Tuple[str, dict]]:
         """处理Word文档"""
         doc = Document(file_path)
-        text = "\n".join([para.text for para in doc.paragraphs])
+        text = "\n".join(para.text for para in doc.paragraphs)
         return self._chunk_text(text, file_path, 0)
 
     # 知识库类中的分块方法优化
@@ -143,12 +255,10 @@ class KnowledgeBase:
 
             # 只向后查找一次边界（提高效率）
             if end < text_len:
-                # 查找最近的边界字符（句号、分号等）
-                boundary_chars = {'.', '。', ';', '；', '!', '！', '?', '？', '\n'}
-                for i in range(end, min(end + 50, text_len)):  # 最多向后查50字符
-                    if text[i] in boundary_chars:
-                        end = i + 1  # 包含边界字符
-                        break
+                # 查找最近的边界字符（句号、分号等），最多向后查50字符
+                match = _BOUNDARY_RE.search(text, end, min(end + 50, text_len))
+                if match:
+                    end = match.end()  # 包含边界字符
 
             chunk = text[start:end]
 
@@ -177,35 +287,93 @@ class KnowledgeBase:
         self.index = None
         self.documents = []
         self.metadata = []
+        self._chunk_hashes = set()
+        self._clear_search_cache()
 
-        # 处理目录中的所有文件
+        # 先汇总所有文件的文本块，再一次性批量编码、一次性加入索引
+        all_chunks = []
         for file_name in os.listdir(documents_path):
             file_path = documents_path / file_name
             if file_path.is_file():
-                self.add_document(str(file_path))
+                all_chunks.extend(self.load_document(str(file_path)))
+
+        all_chunks, hashes = self._dedup(all_chunks)
+        if not all_chunks:
+            logger.warning(f"目录中没有可用的文本块: {documents_dir}")
+            return
+
+        texts, meta_list = zip(*all_chunks)
+        embeddings = self._encode(list(texts))
+
+        self.dimension = embeddings.shape[1]
+        self.index = self._create_index(embeddings)
+        self.documents = list(texts)
+        self.metadata = list(meta_list)
+        self._chunk_hashes.update(hashes)
 
         logger.info(f"知识库索引构建完成，共{len(self.documents)}个文本块")
 
+    def _dedup(self, chunks: List[Tuple[str, dict]]) -> Tuple[List[Tuple[str, dict]], List[bytes]]:
+        """去除已入库或批内重复的文本块，返回保留的文本块及其指纹"""
+        kept, hashes = [], []
+        seen = set()
+        for chunk in chunks:
+            digest = _chunk_hash(chunk[0])
+            if digest in seen or digest in self._chunk_hashes:
+                continue
+            seen.add(digest)
+            kept.append(chunk)
+            hashes.append(digest)
+
+        if len(kept) < len(chunks):
+            logger.info(f"跳过重复文本块 {len(chunks) - len(kept)} 个")
+        return kept, hashes
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        """批量生成float32嵌入向量（L2归一化，内积即余弦相似度）"""
+        embeddings = self.model.encode(
+            texts,
+            batch_size=ENCODE_BATCH_SIZE,
+            show_progress_bar=False,
+            convert_to_numpy=True,
+            normalize_embeddings=True
+        )
+        return embeddings.astype(np.float32, copy=False)
+
+    @staticmethod
+    def _create_index(embeddings: np.ndarray) -> faiss.Index:
+        """用给定向量创建HNSW内积索引（近似检索，查询复杂度约为O(logN)）
+
+        向量以fp16标量量化存储，内存与检索时的访存量减半；
+        归一化向量的分量在[-1, 1]内，fp16精度损失可以忽略。
+        """
+        index = faiss.IndexHNSWSQ(
+            embeddings.shape[1], faiss.ScalarQuantizer.QT_fp16, HNSW_M, faiss.METRIC_INNER_PRODUCT
+        )
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+        if not index.is_trained:
+            index.train(embeddings)
+        index.add(embeddings)
+        return index
+
     def add_document(self, file_path: str):
         """添加单个文档到知识库索引"""
-        chunks_with_meta = self.load_document(file_path)
+        chunks_with_meta, hashes = self._dedup(self.load_document(file_path))
         if not chunks_with_meta:
             return
 
-        texts = [chunk[0] for chunk in chunks_with_meta]
-        meta_list = [chunk[1] for chunk in chunks_with_meta]
+        texts, meta_list = zip(*chunks_with_meta)
+        texts, meta_list = list(texts), list(meta_list)
 
         # 生成嵌入向量
-        embeddings = self.model.encode(texts, show_progress_bar=False)
-        embeddings = embeddings.astype(np.float32)
+        embeddings = self._encode(texts)
 
         n = embeddings.shape[0]
 
         if self.index is None:
             # 初始化新索引
             self.dimension = embeddings.shape[1]
-            self.index = faiss.IndexFlatL2(self.dimension)
-            self.index.add(embeddings)
+            self.index = self._create_index(embeddings)
             self.documents = texts
             self.metadata = meta_list
         else:
@@ -218,20 +386,39 @@ class KnowledgeBase:
             self.documents.extend(texts)
             self.metadata.extend(meta_list)
 
+        self._chunk_hashes.update(hashes)
+        self._clear_search_cache()
         logger.info(f"添加文档成功: {file_path}, 新增 {n} 个文本块")
 
 
     def search(self, query: str, top_k: int = 3) -> List[Tuple[str, dict, float]]:
-        """检索相关文档块"""
+        """检索相关文档块（相同查询直接返回缓存结果）"""
         if ".." in query or "/" in query:
             return []
+
+        key = (query, top_k)
+        with self._search_cache_lock:
+            cached = self._search_cache.get(key)
+            if cached is not None:
+                self._search_cache.move_to_end(key)
+                return list(cached)
+
+        results = self._search(query, top_k)
+        if results:
+            with self._search_cache_lock:
+                self._search_cache[key] = results
+                if len(self._search_cache) > SEARCH_CACHE_SIZE:
+                    self._search_cache.popitem(last=False)
+        return list(results)
+
+    def _search(self, query: str, top_k: int) -> List[Tuple[str, dict, float]]:
+        """编码查询并在FAISS索引中检索"""
         if self.index is None or not self.documents:
             logger.warning("知识库尚未构建")
             return []
 
         # 生成查询嵌入
-        query_embedding = self.model.encode([query])
-        query_embedding = query_embedding.astype(np.float32)
+        query_embedding = self._encode([query])
 
         # 确保top_k不超过文档块数量
         k = min(top_k, len(self.documents))
@@ -245,23 +432,19 @@ class KnowledgeBase:
             logger.error(f"搜索失败: {str(e)}")
             return []
 
-        results = []
-        for i in range(k):
-            idx = indices[0, i]
-            distance = distances[0, i]
-
-            if 0 <= idx < len(self.documents):
-                # 计算相似度分数 (1 / (1 + distance))
-                similarity = np.exp(-distance / self.dimension)
-                results.append((
-                    self.documents[idx],
-                    self.metadata[idx],
-                    similarity
-                ))
+        # 内积索引返回的即为余弦相似度；旧版L2索引仍按距离整体换算
+        if self.index.metric_type == faiss.METRIC_INNER_PRODUCT:
+            sims = distances[0, :k]
+        else:
+            sims = np.exp(-distances[0, :k] / self.dimension)
 
-        # 按相似度降序排序
-        results.sort(key=lambda x: x[2], reverse=True)
-        return results
+        # FAISS结果已按相似度从高到低排列，无需再排序；不足k个时索引为-1
+        n_docs = len(self.documents)
+        return [
+            (self.documents[idx], self.metadata[idx], sim)
+            for idx, sim in zip(indices[0, :k].tolist(), sims.tolist())
+            if 0 <= idx < n_docs
+        ]
 
     def load_index(self, index_path: str):
         index_path = Path(index_path)
@@ -272,15 +455,29 @@ class KnowledgeBase:
         try:
             self.index = faiss.read_index(str(index_path))
             self.dimension = self.index.d
+            if hasattr(self.index, "hnsw"):
+                self.index.hnsw.efSearch = HNSW_EF_SEARCH
 
-            # 加载文档和元数据
+            # 加载文档和元数据：优先读取Parquet（内存映射，无需反序列化pickle）
+            table_path = index_path.with_suffix(".parquet")
             doc_path = index_path.with_suffix(".docs.npy")
             meta_path = index_path.with_suffix(".meta.npy")
 
-            if doc_path.exists() and meta_path.exists():
+            if table_path.exists():
+                table = pq.read_table(str(table_path), memory_map=True)
+                self.documents = table.column("doc").to_pylist()
+                self.metadata = table.select(
+                    [name for name in table.column_names if name != "doc"]
+                ).to_pylist()
+            elif doc_path.exists() and meta_path.exists():
+                # 兼容旧版本保存的npy文件
                 self.documents = np.load(str(doc_path), allow_pickle=True).tolist()
                 self.metadata = np.load(str(meta_path), allow_pickle=True).tolist()
 
+            # 指纹不单独持久化，加载时由文档重新计算（blake2b开销很小）
+            self._chunk_hashes = {_chunk_hash(doc) for doc in self.documents}
+            self._clear_search_cache()
+
             logger.info(f"索引加载成功: {index_path}, 包含 {len(self.documents)} 个文档块")
             return True
         except Exception as e:
@@ -298,12 +495,11 @@ class KnowledgeBase:
             index_path = Path(index_path)
             faiss.write_index(self.index, str(index_path))
 
-            # 保存文档和元数据
-            doc_path = index_path.with_suffix(".docs.npy")
-            meta_path = index_path.with_suffix(".meta.npy")
-
-            np.save(str(doc_path), np.array(self.documents, dtype=object))
-            np.save(str(meta_path), np.array(self.metadata, dtype=object))
+            # 保存文档和元数据：文档为字符串列，元数据各字段展开为独立列
+            table = pa.Table.from_pylist(self.metadata).append_column(
+                "doc", pa.array(self.documents, type=pa.string())
+            )
+            pq.write_table(table, str(index_path.with_suffix(".parquet")), compression="zstd")
 
             logger.info(f"索引保存成功: {index_path}, 包含 {len(self.documents)} 个文档块")
             return True
@@ -3,8 +3,11 @@
 import logging
 import time
 import os
+import atexit
 import httpx
+import orjson
 import asyncio
+from typing import Optional
 from openai import OpenAI, APITimeoutError, RateLimitError
 
 logger = logging.getLogger("llm_integration")
@@ -13,32 +16,67 @@ logger = logging.getLogger("llm_integration")
 DEEPSEEK_API_BASE = "https://api.deepseek.com/v1"
 
 
-def create_openai_client(api_key: str):
-    """创建OpenAI客户端，正确处理DeepSeek API设置"""
-    # 获取代理配置
-    proxy_url = os.getenv("HTTPS_PROXY") or os.getenv("HTTP_PROXY") or \
-                os.getenv("https_proxy") or os.getenv("http_proxy")
-
-    # 创建自定义HTTP客户端
-    timeout = httpx.Timeout(120.0)
-
-    # 正确配置代理
-    transport = None
-    if proxy_url:
-        logger.info(f"使用代理: {proxy_url}")
-        transport = httpx.HTTPTransport(proxy=proxy_url, trust_env=False)
-
-    http_client = httpx.Client(
-        transport=transport,
-        trust_env=False,
-        timeout=timeout
-    )
+def get_proxy_url():
+    """获取代理配置"""
+    return os.getenv("HTTPS_PROXY") or os.getenv("HTTP_PROXY") or \
+        os.getenv("https_proxy") or os.getenv("http_proxy")
+
+
+# 共享HTTP客户端配置：长连接池 + HTTP/2多路复用
+HTTP_TIMEOUT = httpx.Timeout(120.0)
+HTTP_LIMITS = httpx.Limits(max_keepalive_connections=32, max_connections=64)
+
+# 模块级共享客户端，首次使用时创建（此时.env与代理配置已加载）
+_http_client: Optional[httpx.Client] = None
+_async_http_client: Optional[httpx.AsyncClient] = None
+
+
+def get_http_client() -> httpx.Client:
+    """获取共享的同步HTTP客户端"""
+    global _http_client
+    if _http_client is None:
+        proxy_url = get_proxy_url()
+        if proxy_url:
+            logger.info(f"使用代理: {proxy_url}")
+        _http_client = httpx.Client(
+            transport=httpx.HTTPTransport(proxy=proxy_url, trust_env=False, http2=True, limits=HTTP_LIMITS),
+            trust_env=False,
+            timeout=HTTP_TIMEOUT
+        )
+        atexit.register(_http_client.close)
+    return _http_client
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """获取共享的异步HTTP客户端（由主程序在关闭时调用aclose_http_clients释放）"""
+    global _async_http_client
+    if _async_http_client is None:
+        proxy_url = get_proxy_url()
+        if proxy_url:
+            logger.info(f"使用代理: {proxy_url}")
+        _async_http_client = httpx.AsyncClient(
+            transport=httpx.AsyncHTTPTransport(proxy=proxy_url, trust_env=False, http2=True, limits=HTTP_LIMITS),
+            trust_env=False,
+            timeout=HTTP_TIMEOUT
+        )
+    return _async_http_client
+
+
+async def aclose_http_clients():
+    """关闭共享的异步HTTP客户端"""
+    global _async_http_client
+    if _async_http_client is not None:
+        await _async_http_client.aclose()
+        _async_http_client = None
 
+
+def create_openai_client(api_key: str):
+    """创建OpenAI客户端，正确处理DeepSeek API设置（复用共享HTTP连接池）"""
     return OpenAI(
         api_key=api_key,
         base_url=DEEPSEEK_API_BASE,
-        http_client=http_client,
-        timeout=timeout,
+        http_client=get_http_client(),
+        timeout=HTTP_TIMEOUT,
         max_retries=0
     )
 
@@ -49,9 +87,10 @@ async def async_get_completion(
         temperature: float,
         max_tokens: int,
         api_key: str,
-        client: httpx.AsyncClient
+        client: Optional[httpx.AsyncClient] = None
 ) -> str:
-    """异步获取完整的API响应"""
+    """异步获取完整的API响应（未传入client时使用模块共享客户端）"""
+    client = client or get_async_http_client()
     retries = 0
     max_retries = 3
     result = None
@@ -114,41 +153,71 @@ async def async_get_completion(
     return result
 
 
-def generate_stream_response(prompt: str, temperature: float, max_tokens: int, api_key: str):
-    """生成流式响应（打字机效果）"""
+async def generate_stream_response(prompt: str, temperature: float, max_tokens: int, api_key: str):
+    """生成流式响应（打字机效果），异步生成器直接在事件循环中迭代"""
     retries = 0
     max_retries = 2
+    # 已向调用方输出过内容后不能重试，否则会在部分回答之后再拼接一份新回答
+    yielded = False
+
+    client = get_async_http_client()
+    url = f"{DEEPSEEK_API_BASE}/chat/completions"
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json",
+        "Accept": "text/event-stream"
+    }
+    payload = orjson.dumps({
+        "model": "deepseek-chat",
+        "messages": [{"role": "user", "content": prompt}],
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "stream": True
+    })
 
     while retries <= max_retries:
-        client = None
         try:
-            client = create_openai_client(api_key)
             logger.info(f"开始流式API请求: {prompt[:50]}... (重试 {retries}/{max_retries})")
             start_time = time.time()
 
-            # 流式API调用
-            stream = client.chat.completions.create(
-                model="deepseek-chat",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=temperature,
-                max_tokens=max_tokens,
-                stream=True
-            )
-
-            # 逐块生成响应
-            for chunk in stream:
-                if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
-                    yield chunk.choices[0].delta.content
+            # 直接解析SSE事件流，不经过SDK为每个token构造响应对象
+            async with client.stream("POST", url, headers=headers, content=payload) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    error_msg = f"API错误: {response.status_code} - {response.text[:200]}"
+                    if response.status_code == 429:
+                        raise RateLimitError(error_msg, response=response, body=None)
+                    raise Exception(error_msg)
+
+                # 逐块生成响应
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[5:].strip()
+                    if data == "[DONE]":
+                        break
+
+                    choices = orjson.loads(data).get("choices")
+                    if choices:
+                        content = (choices[0].get("delta") or {}).get("content")
+                        if content:
+                            yielded = True
+                            yield content
 
             duration = time.time() - start_time
             logger.info(f"流式请求完成, 耗时: {duration:.2f}秒")
             break
 
-        except (RateLimitError, APITimeoutError) as e:
+        except (RateLimitError, APITimeoutError, httpx.TimeoutException) as e:
+            if yielded:
+                logger.error(f"流式输出中途{type(e).__name__}，不再重试")
+                yield f"[生成出错: {str(e) or type(e).__name__}]"
+                break
+
             # 指数退避策略
             wait_time = min((2 ** retries) * 5, 30)  # 最小5秒，最大30秒
             logger.warning(f"{type(e).__name__}错误, 等待 {wait_time}秒后重试...")
-            time.sleep(wait_time)
+            await asyncio.sleep(wait_time)
             retries += 1
 
             if retries > max_retries:
@@ -161,14 +230,6 @@ def generate_stream_response(prompt: str, temperature: float, max_tokens: int, a
             yield f"[生成出错: {str(e)}]"
             break
 
-        finally:
-            # 安全关闭客户端连接
-            if client:
-                try:
-                    client._client.close()
-                except Exception as e:
-                    logger.warning(f"关闭客户端时出错: {str(e)}")
-
 
 def get_completion(prompt: str, temperature: float, max_tokens: int, api_key: str) -> str:
     """获取完整的API响应"""
@@ -177,7 +238,6 @@ def get_completion(prompt: str, temperature: float, max_tokens: int, api_key: st
     result = None
 
     while retries <= max_retries:
-        client = None
         try:
             client = create_openai_client(api_key)
             logger.info(f"开始API请求: {prompt[:50]}... (重试 {retries}/{max_retries})")
@@ -212,12 +272,4 @@ def get_completion(prompt: str, temperature: float, max_tokens: int, api_key: st
             result = f"生成失败: {str(e)}"
             break
 
-        finally:
-            # 安全关闭客户端连接
-            if client:
-                try:
-                    client._client.close()
-                except Exception as e:
-                    logger.warning(f"关闭客户端时出错: {str(e)}")
-
     return result
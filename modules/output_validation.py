@@ -1,11 +1,18 @@
 # modules/output_validation.py - 输出验证
-import json
 import re
 import logging
-from pydantic import BaseModel, ValidationError
+import orjson
+from pydantic import BaseModel, TypeAdapter, ValidationError
 
 logger = logging.getLogger("output_validation")
 
+# 类似JSON结构的检测与提取
+_JSON_LIKE_RE = re.compile(r'{.*}')
+_JSON_BRACE_RE = re.compile(r'({.*})', re.DOTALL)
+# 非JSON输出清理：控制字符删除表、script标签
+_CTRL_TABLE = dict.fromkeys(range(0x20))
+_SCRIPT_RE = re.compile(r'<script.*?>.*?</script>', re.IGNORECASE | re.DOTALL)
+
 
 # 输出JSON Schema
 class OutputSchema(BaseModel):
@@ -14,42 +21,52 @@ class OutputSchema(BaseModel):
     sources: list[str] = []
 
 
+# 直接从JSON文本校验，省去先解析为dict再构造模型的过程
+_ADAPTER = TypeAdapter(OutputSchema)
+
+
+def _dump(validated: OutputSchema) -> str:
+    """格式化为缩进2格的JSON文本（保留非ASCII字符）"""
+    return orjson.dumps(validated.model_dump(), option=orjson.OPT_INDENT_2).decode()
+
+
 def validate_output(output: str) -> str:
     """输出校验与格式化"""
     if not output:
         return ""
 
+    # 不含"{"时不可能是JSON对象，直接走清理流程
+    has_brace = "{" in output
+
     # 尝试1: 解析为JSON
-    try:
-        data = json.loads(output)
-        validated = OutputSchema(**data)
-        logger.debug("输出成功验证为JSON")
-        return json.dumps(validated.dict(), ensure_ascii=False, indent=2)
-    except (json.JSONDecodeError, ValidationError):
-        pass
+    if has_brace:
+        try:
+            validated = _ADAPTER.validate_json(output)
+            logger.debug("输出成功验证为JSON")
+            return _dump(validated)
+        except ValidationError:
+            pass
 
     # 尝试2: 类似JSON的结构（宽松模式）
-    if re.search(r'{.*}', output):
+    if has_brace and _JSON_LIKE_RE.search(output):
         try:
             # 提取最可能JSON部分
-            match = re.search(r'({.*})', output, re.DOTALL)
+            match = _JSON_BRACE_RE.search(output)
             if match:
-                json_part = match.group(1)
-                data = json.loads(json_part)
-                validated = OutputSchema(**data)
+                validated = _ADAPTER.validate_json(match.group(1))
                 logger.debug("输出成功验证为类似JSON结构")
-                return json.dumps(validated.dict(), ensure_ascii=False, indent=2)
-        except:
+                return _dump(validated)
+        except Exception:
             pass
 
     # 非JSON输出的清理
     logger.debug("输出为非JSON格式，进行清理")
 
     # 1. 移除控制字符
-    clean_output = re.sub(r'[\x00-\x1F]', '', output)
+    clean_output = output.translate(_CTRL_TABLE)
 
-    # 2. 移除潜在危险内容
-    clean_output = re.sub(r'<script.*?>.*?</script>', '', clean_output, flags=re.IGNORECASE)
+    # 2. 移除潜在危险内容（换行已在上一步移除，DOTALL不改变匹配结果）
+    clean_output = _SCRIPT_RE.sub('', clean_output)
 
     # 3. 截断超长输出
     if len(clean_output) > 2000:
@@ -0,0 +1,46 @@
+# modules/pdf_extraction.py - PDF文本提取（供多进程worker使用，只依赖PyPDF2）
+import os
+import atexit
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+from PyPDF2 import PdfReader
+
+# 共享进程池，首次并行提取时创建并在后续文档间复用
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def extract_pages(reader: PdfReader, page_nums: List[int]) -> List[Tuple[int, Optional[str], Optional[str]]]:
+    """提取PDF指定页的文本，返回 (页码, 文本, 错误信息) 列表"""
+    results = []
+    for page_num in page_nums:
+        try:
+            results.append((page_num, reader.pages[page_num].extract_text(), None))
+        except Exception as e:
+            results.append((page_num, None, str(e)))
+    return results
+
+
+def extract_pdf_pages(file_path: str, page_nums: List[int]) -> List[Tuple[int, Optional[str], Optional[str]]]:
+    """子进程入口：打开PDF并提取指定页（顶层函数以便pickle）"""
+    return extract_pages(PdfReader(file_path), page_nums)
+
+
+def get_pool() -> ProcessPoolExecutor:
+    """获取共享进程池（spawn方式下worker只需导入本模块，启动开销小）"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=os.cpu_count() or 1)
+            atexit.register(_pool.shutdown)
+        return _pool
+
+
+def reset_pool():
+    """进程池损坏（如worker异常退出）后丢弃，下次使用时重新创建"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
@@ -1,10 +1,23 @@
 # modules/preprocessing.py - 输入预处理
 import re
 import logging
+from array import array
+from collections import deque
 from . import calculator
 
+# 可选：C实现的Aho-Corasick（pyahocorasick），未安装时使用纯Python自动机
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
 logger = logging.getLogger("preprocessing")
 
+# 输入清理与注入检测用到的字符删除表和正则（模块加载时构建一次）
+_DANGEROUS_CHARS_TABLE = str.maketrans("", "", "<>{}|\\^~[]")
+_WHITESPACE_RE = re.compile(r"\s+")
+_HEX_ESCAPE_RE = re.compile(r"\\x[0-9a-f]{2}")
+
 # 敏感词库 - 可扩展
 SENSITIVE_WORDS = [
     "暴力", "色情", "毒品", "赌博", "诈骗", "恐怖主义",
@@ -15,73 +28,202 @@ SENSITIVE_WORDS = [
     "child abuse", "weapon", "explosive", "extremism"
 ]
 
+# 指令注入特征
+INJECTION_PATTERNS = [
+    "忽略之前", "作为AI", "系统提示", "角色扮演",
+    "忘记指令", "突破限制", "扮演角色", "忽略以上",
+    "previous instructions", "as an AI", "system prompt", "role play",
+    "forget instructions", "bypass restrictions", "play a role"
+]
 
-# 创建 Trie 树结构
-class TrieNode:
-    __slots__ = ['children', 'is_end']
+# 豁免注入检测的功能命令前缀
+_ALLOWED_PREFIXES = ("calc:", "map:", "kb:")
 
-    def __init__(self):
-        self.children = {}
-        self.is_end = False
+# 词数少于该值时用正则多选分支匹配（C实现的正则引擎逐字符开销更小），否则用Aho-Corasick自动机
+REGEX_MAX_WORDS = 500
 
 
+# 敏感词过滤器：小词库用正则多选分支，大词库用Aho-Corasick自动机（纯Python版按UTF-8字节建立状态）
 class SensitiveWordFilter:
     def __init__(self, word_list):
-        self.root = TrieNode()
-        self.build_trie(word_list)
+        self._pattern = None
+        self._automaton = None
+        words = [word for word in word_list if word]
+        if len(words) < REGEX_MAX_WORDS:
+            # 按长度降序排列，同一起点处先尝试较长的词，保证最长匹配
+            self._pattern = re.compile("|".join(
+                re.escape(word) for word in sorted(words, key=len, reverse=True)
+            ) or "(?!)")
+        elif ahocorasick is not None and words:
+            self._automaton = ahocorasick.Automaton()
+            for word in words:
+                self._automaton.add_word(word, len(word))
+            self._automaton.make_automaton()
+        else:
+            self.build_trie(words)
+            self.build_fail_links()
 
     def build_trie(self, words):
-        """构建 Trie 树"""
+        """构建 Trie 树：每个状态一行256项的转移表（-1表示暂无转移），状态0为根"""
+        goto = [[-1] * 256]
+        # 在各状态结束的所有词的字节长度（含失配链上的后缀词）
+        output = [()]
         for word in words:
-            node = self.root
-            for char in word:
-                if char not in node.children:
-                    node.children[char] = TrieNode()
-                node = node.children[char]
-            node.is_end = True
+            data = word.encode("utf-8")
+            if not data:
+                continue
+            state = 0
+            for byte in data:
+                nxt = goto[state][byte]
+                if nxt == -1:
+                    nxt = len(goto)
+                    goto.append([-1] * 256)
+                    output.append(())
+                    goto[state][byte] = nxt
+                state = nxt
+            output[state] = (len(data),)
+        self._goto = goto
+        self._output = output
+
+    def build_fail_links(self):
+        """按层（BFS）计算失配指针，并把失配后的转移直接填入转移表，扫描时每字节只需一次下标访问
+
+        完成后把转移表压平为连续的 array('i')：下标为 状态*256+字节，
+        存储的值同样是 目标状态*256，扫描时只需 state | byte 即可定位下一项。
+        """
+        goto, output = self._goto, self._output
+        fail = [0] * len(goto)
+        queue = deque()
+
+        root = goto[0]
+        for byte in range(256):
+            if root[byte] == -1:
+                root[byte] = 0
+            else:
+                queue.append(root[byte])
+
+        while queue:
+            state = queue.popleft()
+            row = goto[state]
+            fail_row = goto[fail[state]]
+            for byte in range(256):
+                nxt = row[byte]
+                if nxt == -1:
+                    row[byte] = fail_row[byte]
+                else:
+                    fail[nxt] = fail_row[byte]
+                    output[nxt] = output[nxt] + output[fail[nxt]]
+                    queue.append(nxt)
+
+        self._trans = array("i", [nxt << 8 for row in goto for nxt in row])
+        del self._goto
+
+    def _find_spans(self, data):
+        """单遍扫描字节串，返回从左到右、互不重叠的最长匹配区间 [start, end)"""
+        trans, output = self._trans, self._output
+        state = 0
+        longest_end = {}
+        for j, byte in enumerate(data):
+            state = trans[state | byte]
+            for length in output[state >> 8]:
+                start = j - length + 1
+                if longest_end.get(start, -1) < j:
+                    longest_end[start] = j
+        return self._select_spans(longest_end)
+
+    def _find_spans_ac(self, text):
+        """用pyahocorasick扫描字符串，返回字符位置上的匹配区间
+
+        iter_long在文本末尾处于较长词的前缀状态时会漏报较短的词，
+        因此取全部匹配后自行选出最长匹配。
+        """
+        longest_end = {}
+        for j, length in self._automaton.iter(text):
+            start = j - length + 1
+            if longest_end.get(start, -1) < j:
+                longest_end[start] = j
+        return self._select_spans(longest_end)
+
+    @staticmethod
+    def _select_spans(longest_end):
+        """按起点从左到右选取互不重叠的最长匹配区间 [start, end)"""
+        spans = []
+        last = 0
+        for start in sorted(longest_end):
+            if start >= last:
+                last = longest_end[start] + 1
+                spans.append((start, last))
+        return spans
 
     def filter_text(self, text):
         """过滤文本中的敏感词"""
         if not text:
             return text
 
-        # 转换为小写用于匹配（保留原始大小写）
-        lower_text = text.lower()
-        n = len(text)
-        result = []
-        i = 0
-
-        while i < n:
-            found = False
-            node = self.root
-            j = i
-            matched_end = -1
-
-            # 查找最长匹配
-            while j < n and lower_text[j] in node.children:
-                node = node.children[lower_text[j]]
-                if node.is_end:
-                    matched_end = j
-                j += 1
-
-            # 如果找到匹配
-            if matched_end >= i:
-                # 替换敏感词
-                result.append("***")
-                i = matched_end + 1
-                found = True
-                logger.debug(f"过滤敏感词: {text[i:matched_end + 1]}")
-
-            if not found:
-                # 添加非敏感词字符
-                result.append(text[i])
-                i += 1
-
-        return "".join(result)
+        # 转换为小写用于匹配（保留原始大小写）；个别字符（如"İ"）小写后会变成多个字符，
+        # 只扫描与原文等长的部分，保证匹配位置落在原文范围内
+        lower_text = text.lower()[:len(text)]
+        if self._pattern is not None:
+            spans = [match.span() for match in self._pattern.finditer(lower_text)]
+        elif self._automaton is not None:
+            spans = self._find_spans_ac(lower_text)
+        else:
+            data = lower_text.encode("utf-8")
+            spans = self._to_char_spans(data, self._find_spans(data))
+        return self._splice(text, spans)
+
+    @staticmethod
+    def _to_char_spans(data, spans):
+        """把UTF-8字节串上的匹配区间换算为字符位置（逐段解码，总开销与文本长度成正比）"""
+        char_spans = []
+        pos = chars = 0
+        for start, end in spans:
+            chars += len(data[pos:start].decode("utf-8"))
+            char_start = chars
+            chars += len(data[start:end].decode("utf-8"))
+            char_spans.append((char_start, chars))
+            pos = end
+        return char_spans
+
+    @staticmethod
+    def _splice(text, spans):
+        """按匹配区间切片拼接：未命中的片段原样保留，命中部分替换为***"""
+        if not spans:
+            return text
+        parts = []
+        last = 0
+        debug = logger.isEnabledFor(logging.DEBUG)
+        for start, end in spans:
+            parts.append(text[last:start])
+            parts.append("***")
+            last = end
+            if debug:
+                logger.debug("过滤敏感词: %s", text[start:end])
+        parts.append(text[last:])
+        return "".join(parts)
+
+    def contains_any(self, text):
+        """文本中是否出现任一词（单遍扫描，命中即返回）"""
+        if self._pattern is not None:
+            return self._pattern.search(text) is not None
+        if self._automaton is not None:
+            for _ in self._automaton.iter(text):
+                return True
+            return False
+
+        trans, output = self._trans, self._output
+        state = 0
+        for byte in text.encode("utf-8"):
+            state = trans[state | byte]
+            if output[state >> 8]:
+                return True
+        return False
 
 
 # 初始化敏感词过滤器
 sensitive_filter = SensitiveWordFilter(SENSITIVE_WORDS)
+# 注入特征自动机（与逐个子串查找的匹配结果一致，特征按原样区分大小写）
+_INJECTION_AC = SensitiveWordFilter(INJECTION_PATTERNS)
 
 
 def sanitize_input(text: str) -> str:
@@ -90,21 +232,19 @@ def sanitize_input(text: str) -> str:
         return ""
 
     try:
-        # 记录原始输入
-        original = text[:100] + "..." if len(text) > 100 else text
-
         # 1. 敏感词过滤
         clean_text = sensitive_filter.filter_text(text)
 
         # 2. 移除潜在危险字符
-        clean_text = re.sub(r"[<>{}|\\^~\[\]]", "", clean_text)
+        clean_text = clean_text.translate(_DANGEROUS_CHARS_TABLE)
 
         # 3. 标准化空格
-        clean_text = re.sub(r"\s+", " ", clean_text).strip()
+        clean_text = _WHITESPACE_RE.sub(" ", clean_text).strip()
 
-        # 记录变化
-        if clean_text != text:
-            logger.info(f"输入清理: '{original}' -> '{clean_text[:100]}...'")
+        # 记录变化（仅在INFO级别开启时才截取、格式化）
+        if clean_text != text and logger.isEnabledFor(logging.INFO):
+            original = text[:100] + "..." if len(text) > 100 else text
+            logger.info("输入清理: '%s' -> '%s...'", original, clean_text[:100])
 
         return clean_text
 
@@ -119,33 +259,25 @@ def detect_injection(text: str) -> bool:
         return False
 
     # 豁免我们自己的功能命令
-    allowed_prefixes = ["calc:", "map:", "kb:"]
-    if any(text.startswith(prefix) for prefix in allowed_prefixes):
+    if text.startswith(_ALLOWED_PREFIXES):
         return False
 
     # 添加数学表达式白名单
     if calculator and calculator.calculator.is_calculation_request(text):
         return False
 
-    injection_patterns = [
-        "忽略之前", "作为AI", "系统提示", "角色扮演",
-        "忘记指令", "突破限制", "扮演角色", "忽略以上",
-        "previous instructions", "as an AI", "system prompt", "role play",
-        "forget instructions", "bypass restrictions", "play a role"
-    ]
-
     text_lower = text.lower()
 
     # 检查注入模式
-    if any(pattern in text_lower for pattern in injection_patterns):
+    if _INJECTION_AC.contains_any(text_lower):
         return True
 
     # 检查可疑的编码模式
-    if re.search(r"\\x[0-9a-f]{2}", text_lower):
+    if _HEX_ESCAPE_RE.search(text_lower):
         return True
 
-    # 检查多重括号（可能试图覆盖系统提示）
-    if text_lower.count("(") > 3 and text_lower.count(")") > 3:
+    # 检查多重括号（可能试图覆盖系统提示）；不足8个字符时不可能各超过3个，"("不足时不再统计")"
+    if len(text_lower) >= 8 and text_lower.count("(") > 3 and text_lower.count(")") > 3:
         return True
 
     return False
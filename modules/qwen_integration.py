@@ -1,13 +1,17 @@
 # modules/qwen_integration.py
-import json
 import logging
 import httpx
+import orjson
 import re
 
 logger = logging.getLogger("qwen_integration")
 
 QWEN_API_BASE = "https://dashscope.aliyuncs.com/api/v1/services/aigc/text-generation/generation"
 
+# 流式响应行中的SSE标签
+_SSE_ID_RE = re.compile(r'id:\d+')
+_SSE_EVENT_RE = re.compile(r'event:[^ ]+')
+
 
 # 禁用流式响应，返回完整结果
 async def async_get_completion_qwen(prompt: str, temperature: float, max_tokens: int, api_key: str,
@@ -33,9 +37,9 @@ async def async_get_completion_qwen(prompt: str, temperature: float, max_tokens:
     }
 
     try:
-        response = await client.post(url, headers=headers, json=payload, timeout=120.0)
+        response = await client.post(url, headers=headers, content=orjson.dumps(payload), timeout=120.0)
         response.raise_for_status()
-        data = response.json()
+        data = orjson.loads(response.content)
         if "output" in data and "text" in data["output"]:
             return data["output"]["text"]
         elif "output" in data and "choices" in data["output"]:
@@ -54,8 +58,8 @@ def clean_stream_line(line: str) -> str:
     返回纯净的文本。
     """
     # 去除 id:数字 和 event:result:HTTP_STATUS/200 等标签
-    line = re.sub(r'id:\d+', '', line)
-    line = re.sub(r'event:[^ ]+', '', line)
+    line = _SSE_ID_RE.sub('', line)
+    line = _SSE_EVENT_RE.sub('', line)
     line = line.replace(":HTTP_STATUS/200", "")
     # line = line.replace(':', '')
     # 去除多余的空白符
@@ -65,96 +69,104 @@ def clean_stream_line(line: str) -> str:
     return line
 
 
+# 流式响应结束标记
+_STREAM_DONE = object()
+
+
+async def _aiter_raw_lines(response: httpx.Response):
+    """按字节切分响应行（不做逐块文本解码），最后一行可能没有换行符"""
+    pending = bytearray()
+    async for chunk in response.aiter_bytes():
+        pending += chunk
+        lines = pending.split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line
+    if pending:
+        yield pending
+
+
+def _extract_text(data) -> str:
+    """从Qwen返回的JSON中提取文本片段"""
+    if "output" in data and "text" in data["output"]:
+        return data["output"]["text"]
+    elif "choices" in data and len(data["choices"]) > 0:
+        return data["choices"][0]["message"]["content"]
+    logger.warning(f"无法解析的JSON响应内容: {data}")
+    return ""
+
+
+def _parse_stream_line(line: bytes):
+    """解析一行流式响应：返回文本片段，空串表示无内容，_STREAM_DONE表示结束
+
+    DashScope的SSE帧由 id:/event:/:HTTP_STATUS 和 data: 行组成，按行首前缀分派，无需正则清理。
+    """
+    line = line.strip()
+    # id:、event: 以及以冒号开头的注释行（如 :HTTP_STATUS/200）不含正文
+    if not line or line.startswith((b"id:", b"event:", b":")):
+        return ""
+
+    if line.startswith(b"data:"):
+        data = line[5:].strip()
+        if data == b"[DONE]":
+            return _STREAM_DONE
+        try:
+            return _extract_text(orjson.loads(data))
+        except ValueError:
+            # 如果不是JSON，直接当作纯文本输出
+            return clean_stream_line(data.decode("utf-8", "replace"))
+
+    # 处理JSON格式直接响应（偶尔可能出现）
+    if line.startswith((b"{", b"[")):
+        try:
+            return _extract_text(orjson.loads(line))
+        except ValueError:
+            text = line.decode("utf-8", "replace")
+            logger.warning(f"JSON解析失败: {text}")
+            return text
+
+    # 其它纯文本直接输出
+    return clean_stream_line(line.decode("utf-8", "replace"))
+
+
 # 启用流式响应，返回异步生成器
-async def async_get_completion_qwen_stream(prompt: str, temperature: float, max_tokens: int, api_key: str):
-    async with httpx.AsyncClient(timeout=120.0) as client:
-        url = QWEN_API_BASE
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json",
-            "X-DashScope-SSE": "enable"  # 明确启用流式响应
-        }
-        payload = {
-            "model": "qwen-turbo",
-            "input": {
-                "messages": [
-                    {"role": "user", "content": prompt}
-                ]
-            },
-            "parameters": {
-                "temperature": temperature,
-                "max_tokens": max_tokens,
-                "result_format": "text",
-                "incremental_output": True
-            }
+async def async_get_completion_qwen_stream(prompt: str, temperature: float, max_tokens: int, api_key: str,
+                                           client: httpx.AsyncClient):
+    url = QWEN_API_BASE
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json",
+        "X-DashScope-SSE": "enable"  # 明确启用流式响应
+    }
+    payload = {
+        "model": "qwen-turbo",
+        "input": {
+            "messages": [
+                {"role": "user", "content": prompt}
+            ]
+        },
+        "parameters": {
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "result_format": "text",
+            "incremental_output": True
         }
+    }
 
-        try:
-            async with client.stream("POST", url, headers=headers, json=payload) as response:
-                response.raise_for_status()
-
-                logger.debug(f"Qwen响应头: {response.headers}")
-
-                buffer = ""
-
-                async for line_bytes in response.aiter_lines():
-                    line = line_bytes.strip()
-                    if not line:
-                        continue
-
-                    logger.debug(f"原始响应行: {line}")
-
-                    # SSE格式行通常以 data: 开头
-                    if line.startswith("data:"):
-                        data_str = line[len("data:"):].strip()
-                        if data_str == "[DONE]":
-                            break
-
-                        # 清理多余标签
-                        cleaned_line = clean_stream_line(data_str)
-
-                        if not cleaned_line:
-                            continue
-
-                        # 尝试解析JSON数据
-                        try:
-                            event_data = json.loads(cleaned_line)
-                            if "output" in event_data and "text" in event_data["output"]:
-                                text_chunk = event_data["output"]["text"]
-                            elif "choices" in event_data and len(event_data["choices"]) > 0:
-                                text_chunk = event_data["choices"][0]["message"]["content"]
-                            else:
-                                logger.warning(f"无法解析的JSON响应内容: {event_data}")
-                                text_chunk = ""
-
-                            if text_chunk:
-                                # 拼接缓存，yield完整内容
-                                buffer += text_chunk
-                                yield text_chunk
-                        except json.JSONDecodeError:
-                            # 如果不是JSON，直接当作纯文本输出
-                            yield cleaned_line
-
-                    # 处理JSON格式直接响应（偶尔可能出现）
-                    elif line.startswith("{") or line.startswith("["):
-                        try:
-                            data = json.loads(line)
-                            if "output" in data and "text" in data["output"]:
-                                yield data["output"]["text"]
-                            elif "choices" in data and len(data["choices"]) > 0:
-                                yield data["choices"][0]["message"]["content"]
-                            else:
-                                logger.warning(f"无法解析的JSON响应: {data}")
-                        except json.JSONDecodeError:
-                            logger.warning(f"JSON解析失败: {line}")
-                            yield line
-
-                    # 其它纯文本直接输出
-                    else:
-                        cleaned_line = clean_stream_line(line)
-                        if cleaned_line:
-                            yield cleaned_line
-
-        except Exception as e:
-            logger.exception("Qwen流式API调用异常")
-            yield f"[错误: {str(e)}]"
+    try:
+        async with client.stream("POST", url, headers=headers, content=orjson.dumps(payload),
+                                 timeout=120.0) as response:
+            response.raise_for_status()
+
+            logger.debug(f"Qwen响应头: {response.headers}")
+
+            async for line in _aiter_raw_lines(response):
+                text_chunk = _parse_stream_line(line)
+                if text_chunk is _STREAM_DONE:
+                    break
+                if text_chunk:
+                    yield text_chunk
+
+    except Exception as e:
+        logger.exception("Qwen流式API调用异常")
+        yield f"[错误: {str(e)}]"
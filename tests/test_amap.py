@@ -1,7 +1,9 @@
 # tests/test_amap.py - 高德地图API测试（控制台输出版）
-import requests
+import asyncio
+import io
 import json
 import time
+import httpx
 import logging
 from datetime import datetime
 import sys
@@ -16,6 +18,8 @@ logger = logging.getLogger("amap_test")
 
 # API配置
 API_ENDPOINT = "http://localhost:8000/map"
+# 同时在途的最大请求数
+CONCURRENCY = 8
 
 # 40条测试数据（直接嵌入在脚本中）
 TEST_PROMTPS = [
@@ -69,35 +73,22 @@ TEST_PROMTPS = [
 ]
 
 
-def run_amap_test():
-    """执行高德地图API测试（控制台输出详细结果）"""
-    print("\n" + "=" * 60)
-    print("开始高德地图API测试")
-    print(f"测试端点: {API_ENDPOINT}")
-    print(f"测试数量: {len(TEST_PROMTPS)}")
-    print("=" * 60)
-
-    results = []
-    success_count = 0
-    error_count = 0
+async def _run_one(client: httpx.AsyncClient, sem: asyncio.Semaphore, i: int, prompt: str) -> dict:
+    """执行单条测试；输出先写入缓冲区，完成后整体打印，避免并发时交错"""
+    out = io.StringIO()
 
-    for i, prompt in enumerate(TEST_PROMTPS, 1):
-        # 打印测试标题
-        print(f"\n{'=' * 50}")
-        print(f"测试 #{i}/{len(TEST_PROMTPS)}: {prompt}")
-        print(f"{'-' * 50}")
+    # 打印测试标题
+    print(f"\n{'=' * 50}", file=out)
+    print(f"测试 #{i}/{len(TEST_PROMTPS)}: {prompt}", file=out)
+    print(f"{'-' * 50}", file=out)
 
+    async with sem:
         start_time = time.time()
-        response = None
 
         try:
             # 发送POST请求
-            print(f"发送请求: {prompt}")
-            response = requests.post(
-                API_ENDPOINT,
-                json={"prompt": prompt},
-                timeout=15
-            )
+            print(f"发送请求: {prompt}", file=out)
+            response = await client.post(API_ENDPOINT, json={"prompt": prompt})
 
             # 记录结果
             result = {
@@ -108,52 +99,49 @@ def run_amap_test():
             }
 
             # 打印响应详情
-            print(f"响应状态: {response.status_code}")
-            print(f"响应时间: {result['latency']}秒")
+            print(f"响应状态: {response.status_code}", file=out)
+            print(f"响应时间: {result['latency']}秒", file=out)
 
             if response.status_code == 200:
                 json_response = response.json()
                 result["response"] = json_response
-                success_count += 1
 
                 # 格式化打印响应内容
-                print("响应内容:")
+                print("响应内容:", file=out)
                 if "error" in json_response:
-                    print(f"  错误信息: {json_response['error']}")
+                    print(f"  错误信息: {json_response['error']}", file=out)
                 else:
                     for key, value in json_response.items():
                         if isinstance(value, dict):
-                            print(f"  {key}:")
+                            print(f"  {key}:", file=out)
                             for subkey, subvalue in value.items():
-                                print(f"    {subkey}: {subvalue}")
+                                print(f"    {subkey}: {subvalue}", file=out)
                         elif isinstance(value, list):
-                            print(f"  {key}:")
-                            for i, item in enumerate(value, 1):
+                            print(f"  {key}:", file=out)
+                            for j, item in enumerate(value, 1):
                                 if isinstance(item, dict):
-                                    print(f"    结果 #{i}:")
+                                    print(f"    结果 #{j}:", file=out)
                                     for k, v in item.items():
-                                        print(f"      {k}: {v}")
+                                        print(f"      {k}: {v}", file=out)
                                 else:
-                                    print(f"    {item}")
+                                    print(f"    {item}", file=out)
                         else:
-                            print(f"  {key}: {value}")
+                            print(f"  {key}: {value}", file=out)
 
-                print("✓ 测试成功")
+                print("✓ 测试成功", file=out)
             else:
                 result["error"] = response.text[:500]
-                error_count += 1
-                print(f"响应内容: {response.text[:500]}")
-                print("✗ 测试失败")
+                print(f"响应内容: {response.text[:500]}", file=out)
+                print("✗ 测试失败", file=out)
 
-        except requests.exceptions.Timeout:
+        except httpx.TimeoutException:
             result = {
                 "prompt": prompt,
                 "status": "timeout",
                 "error": "请求超时",
                 "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             }
-            error_count += 1
-            print("✗ 请求超时")
+            print("✗ 请求超时", file=out)
         except Exception as e:
             result = {
                 "prompt": prompt,
@@ -161,11 +149,29 @@ def run_amap_test():
                 "error": str(e),
                 "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             }
-            error_count += 1
-            print(f"✗ 发生异常: {str(e)}")
+            print(f"✗ 发生异常: {str(e)}", file=out)
+
+    print(out.getvalue(), end="")
+    return result
+
+
+async def run_amap_test():
+    """执行高德地图API测试（控制台输出详细结果）"""
+    print("\n" + "=" * 60)
+    print("开始高德地图API测试")
+    print(f"测试端点: {API_ENDPOINT}")
+    print(f"测试数量: {len(TEST_PROMTPS)}")
+    print("=" * 60)
+
+    # 各测试相互独立，并发执行；信号量限制同时在途的请求数（避免速率限制）
+    sem = asyncio.Semaphore(CONCURRENCY)
+    async with httpx.AsyncClient(timeout=15) as client:
+        results = await asyncio.gather(
+            *(_run_one(client, sem, i, prompt) for i, prompt in enumerate(TEST_PROMTPS, 1))
+        )
 
-        results.append(result)
-        time.sleep(0.3)  # 避免速率限制
+    success_count = sum(1 for r in results if r["status"] == 200)
+    error_count = len(results) - success_count
 
     # 打印最终报告
     print("\n" + "=" * 60)
@@ -181,4 +187,4 @@ def run_amap_test():
 
 
 if __name__ == "__main__":
-    run_amap_test()
+    asyncio.run(run_amap_test())
@@ -1,9 +1,12 @@
 # tests/test_parameters.py - 参数对比测试
-import requests
+import asyncio
 import json
 import time
+import httpx
 
 API_ENDPOINT = "http://localhost:8000/compare"
+# 同时在途的最大请求数
+CONCURRENCY = 16
 
 # 加载测试提示词
 with open("../data/test_prompts.txt", "r", encoding="utf-8") as f:
@@ -16,20 +19,15 @@ test_cases = [
 ]
 
 
-def run_test():
-    results = []
-
-    for i, test in enumerate(test_cases, 1):
-        print(f"\n测试 #{i}/{len(test_cases)}: {test['prompt'][:30]}...")
+async def run_one(client: httpx.AsyncClient, sem: asyncio.Semaphore, i: int, test: dict) -> dict:
+    """执行单条测试，输出整体打印避免并发时交错"""
+    lines = [f"\n测试 #{i}/{len(test_cases)}: {test['prompt'][:30]}..."]
 
+    async with sem:
         start_time = time.time()
 
         try:
-            response = requests.post(
-                API_ENDPOINT,
-                json=test,
-                timeout=30
-            )
+            response = await client.post(API_ENDPOINT, json=test)
 
             if response.status_code == 200:
                 result = response.json()
@@ -45,8 +43,8 @@ def run_test():
                     "analysis": result["analysis"]
                 }
 
-                print(f"✓ 成功 | 耗时: {duration:.2f}s")
-                print(f"  分析: {result['analysis'][:100]}...")
+                lines.append(f"✓ 成功 | 耗时: {duration:.2f}s")
+                lines.append(f"  分析: {result['analysis'][:100]}...")
 
             else:
                 test_result = {
@@ -54,7 +52,7 @@ def run_test():
                     "status": f"error_{response.status_code}",
                     "error": response.text[:200]
                 }
-                print(f"✗ 错误: {response.status_code} - {response.text[:50]}")
+                lines.append(f"✗ 错误: {response.status_code} - {response.text[:50]}")
 
         except Exception as e:
             test_result = {
@@ -62,10 +60,19 @@ def run_test():
                 "status": "exception",
                 "error": str(e)
             }
-            print(f"✗ 异常: {str(e)}")
+            lines.append(f"✗ 异常: {str(e)}")
+
+    print("\n".join(lines))
+    return test_result
+
 
-        results.append(test_result)
-        time.sleep(0.5)  # 避免速率限制
+async def run_test():
+    # 各测试相互独立，并发执行；信号量限制同时在途的请求数（避免速率限制）
+    sem = asyncio.Semaphore(CONCURRENCY)
+    async with httpx.AsyncClient(timeout=30) as client:
+        results = await asyncio.gather(
+            *(run_one(client, sem, i, test) for i, test in enumerate(test_cases, 1))
+        )
 
     # 保存结果
     with open("parameter_test_results.json", "w", encoding="utf-8") as f:
@@ -77,4 +84,4 @@ def run_test():
 
 
 if __name__ == "__main__":
-    run_test()
+    asyncio.run(run_test())
@@ -1,4 +1,5 @@
 # tests/test_stream.py - 流式响应测试
+import sys
 import time
 import requests
 
@@ -9,13 +10,13 @@ with open("../data/test_prompts.txt", "r", encoding="utf-8") as f:
     test_prompts = [line.strip() for line in f.readlines() if line.strip()]
 
 
-def test_stream_response(prompt: str):
+def test_stream_response(prompt: str, session: requests.Session):
     print(f"\n测试提示: '{prompt[:30]}...'")
     print("=" * 50)
 
     try:
         # 发送请求
-        response = requests.post(
+        response = session.post(
             API_ENDPOINT,
             json={
                 "prompt": prompt,
@@ -32,24 +33,27 @@ def test_stream_response(prompt: str):
             return
 
         print("流式响应开始:")
-        content_buffer = ""
+        received = 0
 
-        # 统一处理所有流式响应
-        for chunk in response.iter_content(chunk_size=None):
-            if chunk:
-                text = chunk.decode('utf-8')
-                print(text, end='', flush=True)
-                content_buffer += text
-                time.sleep(0.05)  # 微小延迟使输出更平滑
+        # 统一处理所有流式响应：到达即输出，不做人为延迟；
+        # 增量解码可正确处理跨块截断的多字节字符
+        response.encoding = "utf-8"
+        for text in response.iter_content(chunk_size=4096, decode_unicode=True):
+            if text:
+                sys.stdout.write(text)
+                sys.stdout.flush()
+                received += len(text)
 
         print("\n流式响应结束")
-        print(f"接收内容长度: {len(content_buffer)} 字符")
+        print(f"接收内容长度: {received} 字符")
 
     except Exception as e:
         print(f"\n测试失败: {str(e)}")
 
 
 if __name__ == "__main__":
-    for prompt in test_prompts:
-        test_stream_response(prompt)
-        time.sleep(1)  # 请求间暂停
+    # 复用同一个会话，keep-alive连接避免每条测试重新建立TCP连接
+    with requests.Session() as session:
+        for prompt in test_prompts:
+            test_stream_response(prompt, session)
+            time.sleep(1)  # 请求间暂停